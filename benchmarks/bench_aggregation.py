@@ -0,0 +1,100 @@
+"""Measure density aggregation of large point sets.
+
+Usage: python benchmarks/bench_aggregation.py [points ...]
+
+Defaults to 1M and 10M points, drawn from a few Gaussian clusters and
+generated chunk by chunk. For each size, both cell shapes are binned
+for the default zoom levels (ZOOMS), for zoom levels 0 to 12 and for
+0 to 15, each in a separate process that reports its peak memory:
+that grows with the number of cells, about fourfold per zoom level
+once cells are smaller than the clusters. For the default zoom levels,
+the output lines also time turning the cells of zoom level 8 into
+HeatmapLayer data and into Polygons, and the rows line reads tuples
+through DensityGrid.update, as from a QuerySet iterator. Requires
+NumPy.
+
+"""
+import os
+import resource
+import sys
+import time
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+
+import numpy  # noqa
+from gmapi.aggregation import ZOOMS, DensityGrid  # noqa
+
+CHUNK = 100000
+
+CLUSTERS = [(48.8, 2.3, 1.5), (40.4, -3.7, 2), (52.5, 13.4, 1),
+            (41.9, 12.5, 2.5), (51.5, -0.1, 1)]
+
+
+def chunks(count, seed=0):
+    """Yield arrays of (lat, lng) points, CHUNK at a time."""
+    random = numpy.random.RandomState(seed)
+    for start in xrange(0, count, CHUNK):
+        size = min(CHUNK, count - start)
+        centers = numpy.array(CLUSTERS)[random.randint(len(CLUSTERS),
+                                                       size=size)]
+        yield centers[:, :2] + random.normal(size=(size, 2)) * centers[:, 2:]
+
+
+def rows(count):
+    """Yield (lat, lng) tuples, like a values_list iterator."""
+    for chunk in chunks(count):
+        for row in chunk.tolist():
+            yield tuple(row)
+
+
+def timed(name, func, count=None):
+    start = time.time()
+    result = func()
+    elapsed = time.time() - start
+    rate = ''
+    if count:
+        rate = '%10.0f points/s' % (count / elapsed)
+    print '%-22s %9.2f s %s' % (name, elapsed, rate)
+    return result
+
+
+def run(count, shape, zooms):
+    """Bin count points, print the timings and the peak memory."""
+    grid = DensityGrid(zooms, shape=shape, size=32)
+
+    def add():
+        for chunk in chunks(count):
+            grid.add(chunk)
+    timed('add, %s, zoom 0-%d' % (shape, zooms[-1]), add, count)
+    print '%-22s %d' % ('cells at zoom %d' % zooms[-1],
+                        len(grid.cells(zooms[-1])[2]))
+    if zooms == ZOOMS:
+        timed('weightedPoints(8)', lambda: grid.weightedPoints(8))
+        timed('polygons(8)', lambda: grid.polygons(8))
+    if count <= 1000000 and shape == 'square' and zooms == ZOOMS:
+        grid = DensityGrid(zooms, size=32)
+        timed('update from rows', lambda: grid.update(rows(count)), count)
+    # ru_maxrss is in kilobytes on Linux.
+    print '%-22s %9.0f MB' % ('peak memory', resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss / 1024.)
+    sys.stdout.flush()
+
+
+def main():
+    counts = [int(n) for n in sys.argv[1:]] or [1000000, 10000000]
+    for count in counts:
+        print '%d points' % count
+        for shape in ('square', 'hex'):
+            for zooms in (ZOOMS, tuple(range(13)), tuple(range(16))):
+                # Each in its own process, for its own peak memory.
+                pid = os.fork()
+                if not pid:
+                    run(count, shape, zooms)
+                    os._exit(0)
+                os.waitpid(pid, 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Compare rebuilding a Map from the database with restoring it.
+
+Usage: python benchmarks/bench_serialization.py [markers]
+
+The "database" is an in-memory SQLite table, so the rebuild times
+are a lower bound for a real database and ORM. Unlike timeit's
+default, the garbage collector stays enabled as it would be in a
+real process. Each time is followed by its ratio to the rebuild;
+"json parse only" is json.loads without restoring any objects, the
+least loads json can take.
+
+"""
+import json
+import random
+import sqlite3
+import sys
+import timeit
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+
+from gmapi import maps  # noqa
+
+
+def database(count):
+    random.seed(0)
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE place (id INTEGER PRIMARY KEY, lat REAL, '
+               'lng REAL, color TEXT, title TEXT)')
+    db.executemany('INSERT INTO place VALUES (?, ?, ?, ?, ?)',
+                   [(i, random.uniform(-80, 80), random.uniform(-180, 180),
+                     random.choice(['red', 'blue', 'green']), 'Place %d' % i)
+                    for i in xrange(count)])
+    return db
+
+
+def build(db):
+    gmap = maps.Map({'center': maps.LatLng(0, 0), 'zoom': 2,
+                     'mapTypeId': maps.MapTypeId.ROADMAP})
+    path = []
+    for i, lat, lng, color, title in db.execute('SELECT * FROM place'):
+        position = maps.LatLng(lat, lng)
+        marker = maps.Marker({'position': position, 'color': color,
+                              'title': title})
+        maps.event.addListener(marker, 'click', 'app.markerClick')
+        if i % 10:
+            marker.setMap(gmap)
+        else:
+            maps.InfoWindow({'content': title}).open(gmap, marker)
+        path.append(position)
+    maps.Polyline({'map': gmap, 'path': path})
+    return gmap
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    db = database(count)
+    gmap = build(db)
+    text = maps.dumps(gmap)
+    styled = maps.dumps(gmap, styles=True)
+    blob = maps.dumps(gmap, binary=True)
+    print ('%d markers; json %d bytes, with styles %d bytes, binary %d bytes'
+           % (count, len(text), len(styled), len(blob)))
+    rebuild = None
+    for name, func in [
+            ('rebuild', lambda: build(db)),
+            ('json parse only', lambda: json.loads(text)),
+            ('dumps json', lambda: maps.dumps(gmap)),
+            ('dumps styles', lambda: maps.dumps(gmap, styles=True)),
+            ('loads json', lambda: maps.loads(text)),
+            ('loads styles', lambda: maps.loads(styled)),
+            ('loads binary', lambda: maps.loads(blob)),
+            ('loads, gc paused', lambda: maps.loads(blob, pause_gc=True))]:
+        timer = timeit.Timer(func, 'import gc; gc.enable()')
+        best = min(timer.repeat(number=1, repeat=5))
+        rebuild = rebuild or best
+        print '%-16s %8.2f ms %6.2fx' % (name, best * 1000, best / rebuild)
+
+
+if __name__ == '__main__':
+    main()
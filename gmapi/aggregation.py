@@ -0,0 +1,235 @@
+"""Density aggregation of large point sets.
+
+A DensityGrid bins coordinates into square or hexagonal cells of Web
+Mercator pixel space, for several zoom levels at once, and turns the
+non-empty cells into weighted points for a HeatmapLayer or into
+Polygons filled by density. Points are added in chunks, so memory
+use depends on the number of non-empty cells rather than on the
+number of points. That number grows about fourfold with each zoom
+level, until the cells are so small that most points have their own,
+so only bin the zoom levels you show:
+
+    grid = DensityGrid(zooms=range(3, 12), size=32, shape='hex')
+    grid.update(Event.objects.all(), fields=('lat', 'lng'))
+    for polygon in grid.polygons(6):
+        polygon.setMap(gmap)
+
+Requires NumPy.
+
+"""
+import itertools
+import math
+import numpy
+from gmapi import maps
+
+
+# Zoom levels a DensityGrid bins for by default. Each higher one can
+# take several times the memory of all of these.
+ZOOMS = tuple(range(11))
+
+# Fill colors of Polygon cells, from the lowest density to the highest.
+COLORS = ('#ffffb2', '#fecc5c', '#fd8d3c', '#f03b20', '#bd0026')
+
+# Cell keys combine two cell coordinates into one int64.
+_SPAN = 2 ** 31
+_OFFSET = 2 ** 30
+
+_SQRT3 = math.sqrt(3)
+
+
+def _project(lats, lngs):
+    """Return the Web Mercator world coordinates (0 to 1) of arrays."""
+    s = numpy.sin(numpy.radians(numpy.clip(lats, -85.0511, 85.0511)))
+    x = (lngs / 360. + .5) % 1.
+    y = .5 - numpy.log((1 + s) / (1 - s)) / (4 * math.pi)
+    return x, y
+
+
+def _unproject(x, y):
+    """Return the latitudes and longitudes of world coordinates."""
+    lats = numpy.degrees(numpy.arctan(numpy.sinh(math.pi * (1 - 2 * y))))
+    return lats, x * 360. - 180.
+
+
+def _encode(a, b):
+    return (a.astype(numpy.int64) + _OFFSET) * _SPAN + (b + _OFFSET)
+
+
+def _decode(keys):
+    return keys // _SPAN - _OFFSET, keys % _SPAN - _OFFSET
+
+
+def _reduce(keys, weights):
+    """Return the unique keys and the sum of the weights of each."""
+    keys, inverse = numpy.unique(keys, return_inverse=True)
+    return keys, numpy.bincount(inverse.ravel(), weights=weights)
+
+
+class DensityGrid(object):
+    """Sums of point weights per cell, for each zoom level in zooms.
+
+    Cells are size pixels wide. Square cells of one zoom level
+    contain exactly four of the next, so they are computed from the
+    highest zoom down. Hexagonal cells ('hex') are pointy-topped and
+    binned for every zoom level separately.
+
+    """
+    def __init__(self, zooms=ZOOMS, size=64, shape='square'):
+        if shape not in ('square', 'hex'):
+            raise ValueError('Unknown cell shape: %r' % shape)
+        self.zooms = sorted(zooms, reverse=True)
+        self.size = size
+        self.shape = shape
+        self.count = 0
+        self._cells = dict((zoom, (numpy.zeros(0, dtype=numpy.int64),
+                                   numpy.zeros(0)))
+                           for zoom in self.zooms)
+        self._pending = dict((zoom, []) for zoom in self.zooms)
+
+    def _bin(self, x, y, zoom):
+        """Return the keys of the cells containing world coordinates."""
+        scale = 256. * 2 ** zoom
+        px, py = x * scale, y * scale
+        if self.shape == 'square':
+            return _encode(numpy.floor(py / self.size),
+                           numpy.floor(px / self.size).astype(numpy.int64))
+        # Axial coordinates, rounded to the nearest hexagon.
+        radius = self.size / _SQRT3
+        q = (_SQRT3 / 3 * px - py / 3) / radius
+        r = 2. / 3 * py / radius
+        rq, rr, rs = numpy.round(q), numpy.round(r), numpy.round(-q - r)
+        dq, dr, ds = abs(rq - q), abs(rr - r), abs(rs + q + r)
+        fix = (dq > dr) & (dq > ds)
+        rq[fix] = -rr[fix] - rs[fix]
+        fix = ~fix & (dr > ds)
+        rr[fix] = -rq[fix] - rs[fix]
+        return _encode(rr, rq.astype(numpy.int64))
+
+    def _merge(self, zoom, keys, sums):
+        """Queue the keys and sums of a chunk for a zoom level.
+
+        Queued chunks are combined with the cells once they hold about
+        as many keys, so each cell is copied a bounded number of times.
+
+        """
+        pending = self._pending[zoom]
+        pending.append((keys, sums))
+        if sum(len(k) for k, s in pending) >= len(self._cells[zoom][0]):
+            self._flush(zoom)
+
+    def _flush(self, zoom):
+        pending = self._pending[zoom]
+        if pending:
+            old, totals = self._cells[zoom]
+            self._cells[zoom] = _reduce(
+                numpy.concatenate([old] + [k for k, s in pending]),
+                numpy.concatenate([totals] + [s for k, s in pending]))
+            del pending[:]
+
+    def add(self, points, weights=None):
+        """Add an array of (lat, lng) points, with optional weights.
+
+        Points with a missing coordinate (NaN) are skipped.
+
+        """
+        points = numpy.asarray(points, dtype=float).reshape(-1, 2)
+        if weights is None:
+            weights = numpy.ones(len(points))
+        else:
+            weights = numpy.asarray(weights, dtype=float)
+        valid = numpy.isfinite(points).all(axis=1)
+        if not valid.all():
+            points, weights = points[valid], weights[valid]
+        if not len(points):
+            return
+        x, y = _project(points[:, 0], points[:, 1])
+        previous = self.zooms[0]
+        keys, sums = _reduce(self._bin(x, y, previous), weights)
+        self._merge(previous, keys, sums)
+        for zoom in self.zooms[1:]:
+            if self.shape == 'square':
+                # Halve the cell coordinates of the previous zoom level.
+                rows, cols = _decode(keys)
+                shift = previous - zoom
+                keys, sums = _reduce(_encode(rows >> shift, cols >> shift),
+                                     sums)
+            else:
+                keys, sums = _reduce(self._bin(x, y, zoom), weights)
+            self._merge(zoom, keys, sums)
+            previous = zoom
+        self.count += len(points)
+
+    def update(self, rows, fields=None, chunk=100000):
+        """Add the points from (lat, lng) or (lat, lng, weight) rows.
+
+        Rows are read and binned chunk at a time. A QuerySet is read
+        through values_list(*fields).iterator(); fields default to
+        ('lat', 'lng').
+
+        """
+        if hasattr(rows, 'values_list'):
+            rows = rows.values_list(*(fields or ('lat', 'lng'))).iterator()
+        rows = iter(rows)
+        while True:
+            block = list(itertools.islice(rows, chunk))
+            if not block:
+                break
+            a = numpy.array(block, dtype=float)
+            self.add(a[:, :2], a[:, 2] if a.shape[1] > 2 else None)
+
+    def _corners(self, zoom):
+        """Return the world coordinates of the cell corners, per cell."""
+        self._flush(zoom)
+        a, b = _decode(self._cells[zoom][0])
+        if self.shape == 'square':
+            x = (b[:, None] + numpy.array([0, 1, 1, 0])) * self.size
+            y = (a[:, None] + numpy.array([0, 0, 1, 1])) * self.size
+        else:
+            radius = self.size / _SQRT3
+            angles = numpy.radians(numpy.arange(6) * 60 - 30)
+            x = (radius * _SQRT3 * (b + a / 2.))[:, None] + \
+                radius * numpy.cos(angles)
+            y = (radius * 1.5 * a)[:, None] + radius * numpy.sin(angles)
+        scale = 256. * 2 ** zoom
+        return x / scale, y / scale
+
+    def cells(self, zoom):
+        """Return the latitudes, longitudes and weights of the cells.
+
+        The coordinates are those of the cell centers.
+
+        """
+        x, y = self._corners(zoom)
+        lats, lngs = _unproject(x.mean(axis=1), y.mean(axis=1))
+        return lats, lngs, self._cells[zoom][1].copy()
+
+    def weightedPoints(self, zoom):
+        """Return the cells as data for a HeatmapLayer."""
+        return [{'location': maps.LatLng(lat, lng),
+                 'weight': int(w) if w == int(w) else w}
+                for lat, lng, w in zip(*[a.tolist()
+                                         for a in self.cells(zoom)])]
+
+    def polygons(self, zoom, colors=COLORS, opacity=.6):
+        """Return the cells as Polygons, filled by density.
+
+        Weights are graded into colors on a logarithmic scale.
+
+        """
+        self._flush(zoom)
+        sums = self._cells[zoom][1]
+        logs = numpy.log(numpy.maximum(sums, 1e-9))
+        low, high = (logs.min(), logs.max()) if len(logs) else (0, 0)
+        grades = numpy.zeros(len(logs), dtype=int)
+        if high > low:
+            grades = numpy.minimum(((logs - low) / (high - low) *
+                                    len(colors)).astype(int),
+                                   len(colors) - 1)
+        lats, lngs = _unproject(*self._corners(zoom))
+        return [maps.Polygon({
+            'paths': [[maps.LatLng(lat, lng) for lat, lng in zip(*ring)]],
+            'fillColor': colors[grade],
+            'fillOpacity': opacity,
+            'strokeWeight': 0,
+        }) for ring, grade in zip(zip(lats.tolist(), lngs.tolist()),
+                                  grades.tolist())]
@@ -0,0 +1,140 @@
+"""Incremental map updates.
+
+A snapshot records what a Map looked like when it was rendered. Once
+the map has changed, diff compares the snapshot to it and returns only
+what the browser needs to catch up: changed map options plus, for
+markers, polylines and polygons, the overlays that were added, the ids
+of those that were removed and the options that changed on the rest.
+Serialize the result with maps.dumps and hand it to the jQuery
+plugin's applyDiff.
+
+Overlays are matched by their id (see Marker.setId). Overlays without
+an id are identified by their content, so a change to one of those is
+sent as a removal plus an addition. Such ids are assigned by snapshot
+and diff, so take the snapshot before the map is rendered.
+
+"""
+import hashlib
+import json
+from gmapi import maps
+
+
+# Serialized map keys of the overlay lists.
+OVERLAYS = ('mkr', 'pln', 'pgn')
+
+
+def _dumps(obj):
+    """Return the JSON of obj, with its keys sorted.
+
+    Options set in a different order then give the same JSON, and so
+    the same digest.
+
+    """
+    return json.dumps(obj, separators=(',', ':'), sort_keys=True)
+
+
+def _index(overlays):
+    """Return (id, JSON, overlay) for each overlay."""
+    index = []
+    seen = {}
+    for overlay in overlays:
+        data = _dumps(dict((k, v) for k, v in overlay.iteritems()
+                           if k != 'oid'))
+        oid = overlay.getId()
+        if oid is None:
+            # Identical overlays get the same digest, so number them.
+            digest = hashlib.sha1(data).hexdigest()[:12]
+            count = seen[digest] = seen.get(digest, -1) + 1
+            oid = digest if not count else '%s.%d' % (digest, count)
+            overlay.setId(oid)
+        index.append((oid, data, overlay))
+    return index
+
+
+def snapshot(gmap):
+    """Record the current state of a Map.
+
+    The snapshot only holds strings, so it can be kept in the session
+    or the cache until the next diff.
+
+    """
+    snap = {
+        'opt': dict((k, _dumps(v)) for k, v in
+                    gmap['arg'].get('opts', {}).iteritems()),
+        'bds': _dumps(gmap['bds']) if 'bds' in gmap else None,
+    }
+    for key in OVERLAYS:
+        snap[key] = dict((oid, data) for oid, data, _ in
+                         _index(gmap.get(key, [])))
+    return snap
+
+
+def _changes(old, new):
+    """Return the options of new that differ from the JSON in old.
+
+    Returns None if anything besides the options differs.
+
+    """
+    old = json.loads(old)
+    old_opts = (old.pop('arg', None) or [{}])[0]
+    new_opts = new['arg'].get('opts', {})
+    rest = dict((k, v) for k, v in new.iteritems() if k not in ('arg', 'oid'))
+    if old != json.loads(_dumps(rest)):
+        return None
+    changes = {}
+    for k in set(old_opts) | set(new_opts):
+        if k not in new_opts:
+            changes[k] = None
+        elif old_opts.get(k) != json.loads(_dumps(new_opts[k])):
+            changes[k] = new_opts[k]
+    return changes
+
+
+def diff(old, new):
+    """Return the changes from old (a snapshot or Map) to the Map new.
+
+    The diff is a dict that only has the parts that changed:
+
+        opt  Map options that changed (None for removed ones).
+        bds  The new bounds from Map.fitBounds.
+        mkr, pln, pgn
+             add  Overlays to add.
+             rm   Ids of overlays to remove.
+             chg  Options that changed, by overlay id.
+
+    An empty dict means there is nothing to do.
+
+    """
+    if isinstance(old, maps.Map):
+        old = snapshot(old)
+    result = {}
+    opts = new['arg'].get('opts', {})
+    changed = dict((k, opts.get(k)) for k in set(old['opt']) | set(opts)
+                   if k not in opts or
+                   old['opt'].get(k) != _dumps(opts[k]))
+    if changed:
+        result['opt'] = changed
+    if 'bds' in new and old['bds'] != _dumps(new['bds']):
+        result['bds'] = new['bds']
+    for key in OVERLAYS:
+        previous = old[key]
+        add, chg = [], {}
+        current = set()
+        for oid, data, overlay in _index(new.get(key, [])):
+            current.add(oid)
+            if oid not in previous:
+                add.append(overlay)
+            elif previous[oid] != data:
+                changes = _changes(previous[oid], overlay)
+                if changes is None:
+                    # Replace it, since only options can be updated.
+                    current.discard(oid)
+                    add.append(overlay)
+                elif changes:
+                    chg[oid] = changes
+        rm = [oid for oid in previous if oid not in current]
+        part = dict((k, v) for k, v in (('add', add), ('rm', rm),
+                                        ('chg', chg)) if v)
+        if part:
+            result[key] = part
+    return result
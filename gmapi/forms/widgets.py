@@ -5,7 +5,6 @@ from django.forms.util import flatatt
 from django.forms.widgets import Widget
 from django.utils.html import escape
 from django.utils.safestring import mark_safe
-from json import dumps
 from gmapi import maps
 
 
@@ -23,6 +22,12 @@ class GoogleMap(Widget):
     def __init__(self, attrs=None):
         self.nojquery = (attrs or {}).pop('nojquery', False)
         self.nomapsjs = (attrs or {}).pop('nomapsjs', False)
+        # Only initialize the javascript map when it nears the viewport.
+        self.lazy = (attrs or {}).pop('lazy', False)
+        # Create overlays in time slices instead of all at once.
+        self.chunked = (attrs or {}).pop('chunked', False)
+        # Write each distinct marker image only once.
+        self.styles = (attrs or {}).pop('styles', False)
         super(GoogleMap, self).__init__(attrs)
 
     def render(self, name, gmap, attrs=None):
@@ -32,6 +37,10 @@ class GoogleMap(Widget):
         if attrs:
             default_attrs.update(attrs)
         final_attrs = self.build_attrs(default_attrs)
+        if self.lazy:
+            final_attrs['class'] = u'%s gmap-lazy' % final_attrs['class']
+        if self.chunked:
+            final_attrs['class'] = u'%s gmap-chunked' % final_attrs['class']
         width = final_attrs.pop('width', 500)
         height = final_attrs.pop('height', 400)
         style = (u'position:relative;width:%dpx;height:%dpx;' %
@@ -39,7 +48,7 @@ class GoogleMap(Widget):
         final_attrs['style'] = style + final_attrs.get('style', '')
         map_div = (u'<div class="%s" style="position:absolute;'
                    u'width:%dpx;height:%dpx"></div>' %
-                   (escape(dumps(gmap, separators=(',', ':'))),
+                   (escape(maps.dumps(gmap, styles=self.styles)),
                     width, height))
         map_img = (u'<img style="position:absolute;z-index:1" '
                    u'width="%(x)d" height="%(y)d" alt="Google Map" '
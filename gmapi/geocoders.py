@@ -0,0 +1,244 @@
+"""Geocoder backends.
+
+A backend answers a geocode request with a decoded Geocoding Web
+Service response (a dict holding 'status' and 'results') or None
+if it has no answer at all. maps.Geocoder turns the response into
+LatLng and LatLngBounds instances, so every backend produces the
+same structures.
+
+"""
+import bisect
+import csv
+import sqlite3
+import time
+import urllib
+from django.conf import settings
+from django.utils.encoding import force_unicode
+from importlib import import_module
+from json import loads
+from gmapi.utils.http import urlencode
+from gmapi.utils.ratelimit import QuotaExceeded, RateLimiter
+from gmapi.utils.singleflight import CachedCall
+
+
+GEOCODE_URL = getattr(settings, 'GMAPI_GEOCODE_URL',
+                      'http://maps.google.com/maps/api/geocode')
+
+GEOCODER_BACKEND = getattr(settings, 'GMAPI_GEOCODER_BACKEND',
+                           'gmapi.geocoders.GoogleBackend')
+
+GEOCODER_CHAIN = getattr(settings, 'GMAPI_GEOCODER_CHAIN',
+                         ['gmapi.geocoders.GazetteerBackend',
+                          'gmapi.geocoders.GoogleBackend'])
+
+GAZETTEER = getattr(settings, 'GMAPI_GAZETTEER', None)
+
+# Limits of the Google Geocoding Web Service. With GMAPI_GEOCODE_SHARED_LIMIT
+# they apply to all processes together, through the cache.
+GEOCODE_QPS = getattr(settings, 'GMAPI_GEOCODE_QPS', 10)
+
+GEOCODE_DAILY_LIMIT = getattr(settings, 'GMAPI_GEOCODE_DAILY_LIMIT', 2500)
+
+GEOCODE_SHARED_LIMIT = getattr(settings, 'GMAPI_GEOCODE_SHARED_LIMIT', False)
+
+# Seconds to stop geocoding after the service keeps reporting that the
+# query limit has been exceeded.
+GEOCODE_PAUSE = getattr(settings, 'GMAPI_GEOCODE_PAUSE', 60)
+
+# Seconds that geocoding responses are cached, and for how much longer a
+# stale one is still served while it is being refreshed.
+GEOCODE_CACHE_TIMEOUT = getattr(settings, 'GMAPI_GEOCODE_CACHE_TIMEOUT', 300)
+
+GEOCODE_CACHE_STALE = getattr(settings, 'GMAPI_GEOCODE_CACHE_STALE', 0)
+
+# Seconds before a cached response expires that it is already refreshed.
+GEOCODE_CACHE_AHEAD = getattr(settings, 'GMAPI_GEOCODE_CACHE_AHEAD', 0)
+
+# Seconds a process may hold the cache lock for a request. If set, only one
+# process at a time queries Google for the same request.
+GEOCODE_LOCK_TIMEOUT = getattr(settings, 'GMAPI_GEOCODE_LOCK_TIMEOUT', None)
+
+rate_limiter = RateLimiter(GEOCODE_QPS, GEOCODE_DAILY_LIMIT,
+                           shared=GEOCODE_SHARED_LIMIT,
+                           prefix='gmapi.geocode')
+
+cached_call = CachedCall(GEOCODE_CACHE_TIMEOUT, GEOCODE_CACHE_STALE,
+                         GEOCODE_LOCK_TIMEOUT, ahead=GEOCODE_CACHE_AHEAD)
+
+
+_backends = {}
+
+
+def get_backend(path=None):
+    """Return a shared instance of the backend class at path.
+
+    Defaults to the GMAPI_GEOCODER_BACKEND setting.
+
+    """
+    path = path or GEOCODER_BACKEND
+    if path not in _backends:
+        module, name = path.rsplit('.', 1)
+        _backends[path] = getattr(import_module(module), name)()
+    return _backends[path]
+
+
+def _normalize(address):
+    """Lower case an address and collapse its whitespace."""
+    return u' '.join(force_unicode(address).lower().split())
+
+
+class BaseBackend(object):
+    """A source of geocoding responses."""
+    def geocode(self, request):
+        raise NotImplementedError
+
+
+class GoogleBackend(BaseBackend):
+    """Queries the Google Geocoding Web Service.
+
+    Responses are cached and concurrent identical requests share one
+    query (see gmapi.utils.singleflight). Queries go through a
+    RateLimiter (the module's rate_limiter by default), which raises
+    QuotaExceeded instead of querying once the daily quota is used up.
+    If the service still reports that the query limit has been
+    exceeded, the request is retried a few times and geocoding is then
+    paused for GEOCODE_PAUSE seconds.
+
+    """
+    retries = 3
+
+    def __init__(self, url=None, limiter=None):
+        self.url = url or GEOCODE_URL
+        self.limiter = limiter or rate_limiter
+
+    def geocode(self, request):
+        cache_key = urlencode(request)
+        return loads(cached_call.get(cache_key, self._query, cache_key))
+
+    def _query(self, query):
+        url = '%s/json?%s' % (self.url, query)
+        for attempt in xrange(self.retries):
+            self.limiter.acquire()
+            data = urllib.urlopen(url).read()
+            if loads(data)['status'] != 'OVER_QUERY_LIMIT':
+                return data
+            if attempt + 1 < self.retries:
+                # Over limit, wait a bit longer each time.
+                time.sleep(.5 * (attempt + 1))
+        self.limiter.pause(GEOCODE_PAUSE)
+        raise QuotaExceeded('Geocoding has failed too many times. '
+                            'You might have exceeded your daily limit.')
+
+
+class GazetteerBackend(BaseBackend):
+    """Answers address requests from a local gazetteer.
+
+    The source is a CSV file, an SQLite database with a 'gazetteer'
+    table, or any iterable of dicts. Each entry needs an 'address',
+    'lat' and 'lng' and may also have a 'formatted_address' and a
+    bounding box ('south', 'west', 'north', 'east').
+
+    Addresses are normalized and kept in a sorted index, so both
+    exact and prefix matches are a binary search away. Requests it
+    can't answer return None.
+
+    """
+    def __init__(self, source=None, prefix=True, limit=10):
+        self.source = source or GAZETTEER
+        self.prefix = prefix
+        self.limit = limit
+        self._keys = None
+        self._entries = None
+
+    def _rows(self):
+        source = self.source
+        if not isinstance(source, basestring):
+            return source
+        if source.endswith(('.db', '.sqlite', '.sqlite3')):
+            connection = sqlite3.connect(source)
+            try:
+                cursor = connection.execute('SELECT * FROM gazetteer')
+                names = [d[0] for d in cursor.description]
+                return [dict(zip(names, row)) for row in cursor]
+            finally:
+                connection.close()
+        with open(source, 'rb') as f:
+            # DictReader fills in missing trailing fields with None.
+            return [dict((k, force_unicode(v or '')) for k, v in row.items())
+                    for row in csv.DictReader(f)]
+
+    def load(self):
+        """Build the address index from the source."""
+        index = {}
+        for row in self._rows() if self.source else []:
+            key = _normalize(row['address'])
+            if key in index:
+                continue
+            bounds = None
+            if all(row.get(k) not in (None, '')
+                   for k in ('south', 'west', 'north', 'east')):
+                bounds = tuple(float(row[k])
+                               for k in ('south', 'west', 'north', 'east'))
+            index[key] = (force_unicode(row.get('formatted_address') or
+                                        row['address']),
+                          float(row['lat']), float(row['lng']), bounds)
+        keys = sorted(index)
+        self._entries = [index[k] for k in keys]
+        self._keys = keys
+
+    def _result(self, entry):
+        address, lat, lng, bounds = entry
+        geometry = {'location': {'lat': lat, 'lng': lng},
+                    'location_type': 'APPROXIMATE'}
+        if bounds:
+            south, west, north, east = bounds
+            geometry['viewport'] = {
+                'southwest': {'lat': south, 'lng': west},
+                'northeast': {'lat': north, 'lng': east},
+            }
+        return {'formatted_address': address, 'geometry': geometry,
+                'types': []}
+
+    def geocode(self, request):
+        if 'address' not in request:
+            return None
+        if self._keys is None:
+            self.load()
+        key = _normalize(request['address'])
+        keys = self._keys
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return {'status': 'OK',
+                    'results': [self._result(self._entries[i])]}
+        if not self.prefix or not key:
+            return None
+        results = []
+        while (i < len(keys) and len(results) < self.limit and
+               keys[i].startswith(key)):
+            result = self._result(self._entries[i])
+            result['partial_match'] = True
+            results.append(result)
+            i += 1
+        if results:
+            return {'status': 'OK', 'results': results}
+        return None
+
+
+class ChainBackend(BaseBackend):
+    """Tries several backends in turn.
+
+    The first response other than ZERO_RESULTS wins. By default the
+    local gazetteer is asked first and Google second.
+
+    """
+    def __init__(self, backends=None):
+        self.backends = [get_backend(b) if isinstance(b, basestring) else b
+                         for b in backends or GEOCODER_CHAIN]
+
+    def geocode(self, request):
+        response = None
+        for backend in self.backends:
+            response = backend.geocode(dict(request)) or response
+            if response and response['status'] != 'ZERO_RESULTS':
+                break
+        return response
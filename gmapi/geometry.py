@@ -0,0 +1,508 @@
+"""Spherical geometry on the server.
+
+Mirrors google.maps.geometry.spherical and google.maps.geometry.poly.
+Points may be LatLng instances or (lat, lng) pairs. Each function
+has a Batch variant that works on whole sequences of coordinates at
+once. These use NumPy when it is installed (and return arrays) and
+fall back to plain Python loops (returning lists) when it isn't.
+
+"""
+import math
+import numbers
+from gmapi import maps
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# The radius used by google.maps.geometry, in meters.
+EARTH_RADIUS = 6378137
+
+
+class _Scalar(object):
+    """Math functions for single values."""
+    sin, cos, tan, asin, atan2, sqrt, radians, degrees = (
+        math.sin, math.cos, math.tan, math.asin, math.atan2, math.sqrt,
+        math.radians, math.degrees)
+
+
+if numpy is not None:
+    class _Vector(object):
+        """Math functions for arrays of values."""
+        sin, cos, tan, asin, atan2, sqrt, radians, degrees = (
+            numpy.sin, numpy.cos, numpy.tan, numpy.arcsin, numpy.arctan2,
+            numpy.sqrt, numpy.radians, numpy.degrees)
+
+
+def _coords(point):
+    """Return point as a (lat, lng) pair."""
+    if isinstance(point, maps.LatLng):
+        return point.lat(), point.lng()
+    return point[0], point[1]
+
+
+def _path(obj):
+    """Return the path of a Polyline/Polygon, or obj itself."""
+    if isinstance(obj, (maps.Polyline, maps.Polygon)):
+        return obj.getPath() or []
+    return obj
+
+
+def _paths(obj):
+    """Return the paths of a Polygon, or obj as a single path."""
+    if isinstance(obj, maps.Polygon):
+        return obj.getPaths() or []
+    return [_path(obj)]
+
+
+def _array(points):
+    """Return points as an array of shape (n, 2)."""
+    if isinstance(points, numpy.ndarray):
+        return points.astype(float).reshape(-1, 2)
+    return numpy.array([_coords(p) for p in points],
+                       dtype=float).reshape(-1, 2)
+
+
+def _wrap(value, low, high):
+    return (value - low) % (high - low) + low
+
+
+def _angle(m, lat1, lng1, lat2, lng2):
+    """Central angle between two points (radians), by haversine."""
+    return 2 * m.asin(m.sqrt(m.sin((lat1 - lat2) / 2) ** 2 +
+                             m.cos(lat1) * m.cos(lat2) *
+                             m.sin((lng1 - lng2) / 2) ** 2))
+
+
+def _distance(m, fromLat, fromLng, toLat, toLng, radius):
+    return radius * _angle(m, m.radians(fromLat), m.radians(fromLng),
+                           m.radians(toLat), m.radians(toLng))
+
+
+def _heading(m, fromLat, fromLng, toLat, toLng):
+    lat1, lat2 = m.radians(fromLat), m.radians(toLat)
+    dLng = m.radians(toLng) - m.radians(fromLng)
+    heading = m.atan2(m.sin(dLng) * m.cos(lat2),
+                      m.cos(lat1) * m.sin(lat2) -
+                      m.sin(lat1) * m.cos(lat2) * m.cos(dLng))
+    return _wrap(m.degrees(heading), -180, 180)
+
+
+def _offset(m, fromLat, fromLng, distance, heading, radius):
+    angle = distance / float(radius)
+    heading = m.radians(heading)
+    lat, lng = m.radians(fromLat), m.radians(fromLng)
+    sinLat = (m.sin(lat) * m.cos(angle) +
+              m.cos(lat) * m.sin(angle) * m.cos(heading))
+    dLng = m.atan2(m.sin(angle) * m.cos(lat) * m.sin(heading),
+                   m.cos(angle) - m.sin(lat) * sinLat)
+    return (m.degrees(m.asin(sinLat)),
+            _wrap(m.degrees(lng + dLng), -180, 180))
+
+
+def _interpolate(m, fromLat, fromLng, toLat, toLng, fraction):
+    lat1, lng1 = m.radians(fromLat), m.radians(fromLng)
+    lat2, lng2 = m.radians(toLat), m.radians(toLng)
+    angle = _angle(m, lat1, lng1, lat2, lng2)
+    # Fall back to linear weights for (nearly) identical points.
+    sinAngle = m.sin(angle) + (angle < 1e-12)
+    a = m.sin((1 - fraction) * angle) / sinAngle
+    b = m.sin(fraction * angle) / sinAngle
+    a = a + (angle < 1e-12) * (1 - fraction)
+    b = b + (angle < 1e-12) * fraction
+    x = a * m.cos(lat1) * m.cos(lng1) + b * m.cos(lat2) * m.cos(lng2)
+    y = a * m.cos(lat1) * m.sin(lng1) + b * m.cos(lat2) * m.sin(lng2)
+    z = a * m.sin(lat1) + b * m.sin(lat2)
+    return (m.degrees(m.atan2(z, m.sqrt(x * x + y * y))),
+            m.degrees(m.atan2(y, x)))
+
+
+def _polarTriangles(m, lats, lngs):
+    """Signed areas (on the unit sphere) of a path's polar triangles."""
+    tans = m.tan((math.pi / 2 - m.radians(lats)) / 2)
+    lngs = m.radians(lngs)
+    t = tans[1:] * tans[:-1]
+    dLng = lngs[1:] - lngs[:-1]
+    return 2 * m.atan2(t * m.sin(dLng), 1 + t * m.cos(dLng))
+
+
+class spherical(object):
+    """Spherical namespace. No need to instantiate."""
+    @staticmethod
+    def computeDistanceBetween(fromPoint, toPoint, radius=EARTH_RADIUS):
+        """Distance in meters between two points."""
+        return _distance(_Scalar, *(_coords(fromPoint) + _coords(toPoint) +
+                                    (radius,)))
+
+    @staticmethod
+    def computeDistanceBetweenBatch(fromPoints, toPoints,
+                                    radius=EARTH_RADIUS):
+        if numpy is None:
+            return [spherical.computeDistanceBetween(f, t, radius)
+                    for f, t in zip(fromPoints, toPoints)]
+        f, t = _array(fromPoints), _array(toPoints)
+        return _distance(_Vector, f[:, 0], f[:, 1], t[:, 0], t[:, 1], radius)
+
+    @staticmethod
+    def computeHeading(fromPoint, toPoint):
+        """Heading in degrees from north, in the range [-180, 180)."""
+        return _heading(_Scalar, *(_coords(fromPoint) + _coords(toPoint)))
+
+    @staticmethod
+    def computeHeadingBatch(fromPoints, toPoints):
+        if numpy is None:
+            return [spherical.computeHeading(f, t)
+                    for f, t in zip(fromPoints, toPoints)]
+        f, t = _array(fromPoints), _array(toPoints)
+        return _heading(_Vector, f[:, 0], f[:, 1], t[:, 0], t[:, 1])
+
+    @staticmethod
+    def computeOffset(fromPoint, distance, heading, radius=EARTH_RADIUS):
+        """The LatLng reached by moving distance meters along heading."""
+        lat, lng = _coords(fromPoint)
+        return maps.LatLng(*_offset(_Scalar, lat, lng, distance, heading,
+                                    radius))
+
+    @staticmethod
+    def computeOffsetBatch(fromPoints, distances, headings,
+                           radius=EARTH_RADIUS):
+        """Offset many points; returns (lat, lng) pairs."""
+        if numpy is None:
+            return [_offset(_Scalar, *(_coords(f) + (d, h, radius)))
+                    for f, d, h in zip(fromPoints, distances, headings)]
+        f = _array(fromPoints)
+        lats, lngs = _offset(_Vector, f[:, 0], f[:, 1],
+                             numpy.asarray(distances, dtype=float),
+                             numpy.asarray(headings, dtype=float), radius)
+        return numpy.column_stack((lats, lngs))
+
+    @staticmethod
+    def interpolate(fromPoint, toPoint, fraction):
+        """The LatLng fraction of the way along the great circle."""
+        return maps.LatLng(*_interpolate(
+            _Scalar, *(_coords(fromPoint) + _coords(toPoint) + (fraction,))))
+
+    @staticmethod
+    def interpolateBatch(fromPoints, toPoints, fractions):
+        """Interpolate many pairs of points; returns (lat, lng) pairs."""
+        if numpy is None:
+            return [_interpolate(_Scalar, *(_coords(f) + _coords(t) + (x,)))
+                    for f, t, x in zip(fromPoints, toPoints, fractions)]
+        f, t = _array(fromPoints), _array(toPoints)
+        lats, lngs = _interpolate(_Vector, f[:, 0], f[:, 1], t[:, 0],
+                                  t[:, 1], numpy.asarray(fractions,
+                                                         dtype=float))
+        return numpy.column_stack((lats, lngs))
+
+    @staticmethod
+    def computeLength(path, radius=EARTH_RADIUS):
+        """Length in meters of a path (or Polyline)."""
+        points = [_coords(p) for p in _path(path)]
+        return sum(_distance(_Scalar, *(a + b + (radius,)))
+                   for a, b in zip(points, points[1:]))
+
+    @staticmethod
+    def computeLengthBatch(paths, radius=EARTH_RADIUS):
+        if numpy is None:
+            return [spherical.computeLength(p, radius) for p in paths]
+        lengths = []
+        for path in paths:
+            a = _array(_path(path))
+            lengths.append(_distance(_Vector, a[:-1, 0], a[:-1, 1],
+                                     a[1:, 0], a[1:, 1], radius).sum())
+        return numpy.array(lengths)
+
+    @staticmethod
+    def computeSignedArea(path, radius=EARTH_RADIUS):
+        """Area in square meters of a closed path.
+
+        Positive for counter-clockwise paths, negative otherwise.
+
+        """
+        points = [_coords(p) for p in _path(path)]
+        if len(points) < 3:
+            return 0.0
+        points = points[-1:] + points
+        total = 0.0
+        for (lat1, lng1), (lat2, lng2) in zip(points, points[1:]):
+            t = (math.tan((math.pi / 2 - math.radians(lat1)) / 2) *
+                 math.tan((math.pi / 2 - math.radians(lat2)) / 2))
+            dLng = math.radians(lng2) - math.radians(lng1)
+            total += 2 * math.atan2(t * math.sin(dLng),
+                                    1 + t * math.cos(dLng))
+        return total * radius * radius
+
+    @staticmethod
+    def computeArea(path, radius=EARTH_RADIUS):
+        """Area in square meters of a closed path (or Polygon)."""
+        return abs(spherical.computeSignedArea(path, radius))
+
+    @staticmethod
+    def computeAreaBatch(paths, radius=EARTH_RADIUS):
+        if numpy is None:
+            return [spherical.computeArea(p, radius) for p in paths]
+        areas = []
+        for path in paths:
+            a = _array(_path(path))
+            if len(a) < 3:
+                areas.append(0.0)
+                continue
+            a = numpy.vstack((a[-1:], a))
+            areas.append(abs(_polarTriangles(_Vector, a[:, 0],
+                                             a[:, 1]).sum()) * radius * radius)
+        return numpy.array(areas)
+
+
+class poly(object):
+    """Poly namespace. No need to instantiate.
+
+    Edges are treated as straight lines in latitude/longitude space.
+
+    """
+    @staticmethod
+    def containsLocation(point, polygon):
+        """Check if point lies inside a path or Polygon.
+
+        Polygons with several paths use the even-odd rule.
+
+        """
+        lat, lng = _coords(point)
+        inside = False
+        for path in _paths(polygon):
+            points = [_coords(p) for p in path]
+            for (lat1, lng1), (lat2, lng2) in zip(points,
+                                                  points[-1:] + points):
+                if ((lng1 > lng) != (lng2 > lng) and
+                        lat < (lat2 - lat1) * (lng - lng1) /
+                        (lng2 - lng1) + lat1):
+                    inside = not inside
+        return inside
+
+    @staticmethod
+    def containsLocationBatch(points, polygon):
+        if numpy is None:
+            return [poly.containsLocation(p, polygon) for p in points]
+        a = _array(points)
+        lat, lng = a[:, 0], a[:, 1]
+        inside = numpy.zeros(len(a), dtype=bool)
+        for path in _paths(polygon):
+            p = _array(path)
+            for (lat1, lng1), (lat2, lng2) in zip(p, numpy.roll(p, 1, 0)):
+                if lng1 == lng2:
+                    continue
+                crosses = (lng1 > lng) != (lng2 > lng)
+                crosses &= lat < ((lat2 - lat1) * (lng - lng1) /
+                                  (lng2 - lng1) + lat1)
+                inside ^= crosses
+        return inside
+
+    @staticmethod
+    def isLocationOnEdge(point, path, tolerance=1e-9):
+        """Check if point lies within tolerance degrees of an edge."""
+        lat, lng = _coords(point)
+        points = [_coords(p) for p in _path(path)]
+        for (lat1, lng1), (lat2, lng2) in zip(points, points[1:]):
+            dLat, dLng = lat2 - lat1, lng2 - lng1
+            length = dLat * dLat + dLng * dLng
+            f = 0 if not length else max(0, min(1, (
+                (lat - lat1) * dLat + (lng - lng1) * dLng) / length))
+            if math.hypot(lat - lat1 - f * dLat,
+                          lng - lng1 - f * dLng) <= tolerance:
+                return True
+        return False
+
+
+class encoding(object):
+    """Encoding namespace. No need to instantiate.
+
+    Uses the Encoded Polyline Algorithm Format, which keeps five
+    decimal places.
+
+    """
+    @staticmethod
+    def encodePath(path):
+        """Encode a path (or the path of a Polyline/Polygon)."""
+        result = []
+        lastLat = lastLng = 0
+        for point in _path(path):
+            lat, lng = _coords(point)
+            lat, lng = int(round(lat * 1e5)), int(round(lng * 1e5))
+            for value in (lat - lastLat, lng - lastLng):
+                value = ~(value << 1) if value < 0 else value << 1
+                while value >= 0x20:
+                    result.append(chr((0x20 | (value & 0x1f)) + 63))
+                    value >>= 5
+                result.append(chr(value + 63))
+            lastLat, lastLng = lat, lng
+        return ''.join(result)
+
+    @staticmethod
+    def decodePath(encodedPath):
+        """Decode an encoded path into a list of LatLngs."""
+        path = []
+        values = [0, 0]
+        value = shift = i = 0
+        for c in encodedPath:
+            b = ord(c) - 63
+            value |= (b & 0x1f) << shift
+            shift += 5
+            if b < 0x20:
+                values[i] += ~(value >> 1) if value & 1 else value >> 1
+                value = shift = 0
+                i = 1 - i
+                if not i:
+                    path.append(maps.LatLng(values[0] / 1e5, values[1] / 1e5))
+        return path
+
+
+# First zoom level of each band that levelsOfDetail simplifies paths for.
+LOD_ZOOMS = (0, 4, 8, 12, 16)
+
+
+def _project(points):
+    """Return the Web Mercator world coordinates (0 to 1) of points."""
+    xs, ys = [], []
+    for lat, lng in points:
+        s = math.sin(math.radians(max(-85.0511, min(85.0511, lat))))
+        xs.append(lng / 360. + .5)
+        ys.append(.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi))
+    return xs, ys
+
+
+def _farthest(xs, ys, first, last):
+    """Return the index and squared distance of the vertex between
+    first and last farthest from the segment joining them."""
+    x1, y1 = xs[first], ys[first]
+    dx, dy = xs[last] - x1, ys[last] - y1
+    length = dx * dx + dy * dy
+    if numpy is not None and last - first > 64:
+        px = xs[first + 1:last] - x1
+        py = ys[first + 1:last] - y1
+        if length:
+            t = numpy.clip((px * dx + py * dy) / length, 0, 1)
+            px, py = px - t * dx, py - t * dy
+        d = px * px + py * py
+        i = int(d.argmax())
+        return first + 1 + i, float(d[i])
+    best, index = -1, None
+    for i in xrange(first + 1, last):
+        px, py = xs[i] - x1, ys[i] - y1
+        if length:
+            t = max(0, min(1, (px * dx + py * dy) / length))
+            px, py = px - t * dx, py - t * dy
+        d = px * px + py * py
+        if d > best:
+            best, index = d, i
+    return index, best
+
+
+def _significance(xs, ys):
+    """Return the largest Douglas-Peucker tolerance keeping each vertex.
+
+    The algorithm runs once without a tolerance. Capping each vertex
+    at the value of the vertex that split its range makes the ones
+    above any tolerance exactly those Douglas-Peucker would keep.
+
+    """
+    n = len(xs)
+    significance = [0.0] * n
+    if not n:
+        return significance
+    significance[0] = significance[-1] = float('inf')
+    if numpy is not None:
+        xs, ys = numpy.array(xs), numpy.array(ys)
+    stack = [(0, n - 1, float('inf'))]
+    while stack:
+        first, last, cap = stack.pop()
+        if last - first < 2:
+            continue
+        index, d = _farthest(xs, ys, first, last)
+        d = min(math.sqrt(d), cap)
+        significance[index] = d
+        stack.append((first, index, d))
+        stack.append((index, last, d))
+    return significance
+
+
+def levelsOfDetail(path, zooms=LOD_ZOOMS, pixels=1):
+    """Simplify a path for each band of zoom levels.
+
+    Returns one path per zoom in zooms. Each is simplified with the
+    Douglas-Peucker algorithm in Web Mercator space, so that it
+    differs from the original by at most pixels pixels up to the
+    zoom level before the next band. The last band keeps the full
+    path.
+
+    """
+    path = list(_path(path))
+    xs, ys = _project([_coords(p) for p in path])
+    significance = _significance(xs, ys)
+    levels = []
+    for zoom in zooms[1:]:
+        # One pixel at the highest zoom of the band, in world coordinates.
+        tolerance = pixels / (256. * 2 ** (zoom - 1))
+        levels.append([p for p, s in zip(path, significance)
+                       if s > tolerance])
+    return levels + [path]
+
+
+def _isPair(obj):
+    """Check if obj is a (lat, lng) pair: two numbers in a sequence."""
+    try:
+        return len(obj) == 2 and all(isinstance(v, numbers.Real) for v in obj)
+    except TypeError:
+        return False
+
+
+def _points(obj):
+    """Yield the (lat, lng) pairs in any map object."""
+    if isinstance(obj, maps.LatLng):
+        yield obj.lat(), obj.lng()
+    elif isinstance(obj, maps.Map):
+        for o in obj.markers + obj.polylines + obj.polygons:
+            for p in _points(o):
+                yield p
+    elif isinstance(obj, maps.Marker):
+        if obj.getPosition():
+            yield _coords(obj.getPosition())
+    elif isinstance(obj, (maps.Polyline, maps.Polygon)):
+        for path in _paths(obj):
+            for p in path:
+                yield _coords(p)
+    elif _isPair(obj):
+        yield obj[0], obj[1]
+    else:
+        for o in obj:
+            for p in _points(o):
+                yield p
+
+
+def computeBounds(obj):
+    """Return the LatLngBounds of any map objects.
+
+    Accepts a Map, Markers, Polylines, Polygons, LatLngs, (lat, lng)
+    pairs or sequences of them. The result doesn't cross the
+    antimeridian.
+
+    """
+    return computeBoundsBatch(list(_points(obj)))
+
+
+def computeBoundsBatch(points):
+    """Return the LatLngBounds of a sequence of coordinates."""
+    if numpy is not None:
+        a = _array(points)
+        if not len(a):
+            return maps.LatLngBounds()
+        south, west = a.min(axis=0)
+        north, east = a.max(axis=0)
+    else:
+        points = [_coords(p) for p in points]
+        if not points:
+            return maps.LatLngBounds()
+        lats, lngs = zip(*points)
+        south, west, north, east = min(lats), min(lngs), max(lats), max(lngs)
+    return maps.LatLngBounds(maps.LatLng(south, west),
+                             maps.LatLng(north, east))
@@ -1,24 +1,30 @@
 """Implements the Google Maps API v3."""
-import time
-import urllib
+import gc
+import json
+import marshal
+import re
+import zlib
+from functools import partial
 from django.conf import settings
-from django.core.cache import cache
 from django.utils.encoding import force_unicode, smart_str
-from json import loads
+from gmapi.geocoders import GEOCODE_URL, get_backend  # noqa
 from gmapi.utils.http import urlencode
 
 
 STATIC_URL = getattr(settings, 'GMAPI_STATIC_URL',
                      'http://maps.google.com/maps/api/staticmap')
 
-GEOCODE_URL = getattr(settings, 'GMAPI_GEOCODE_URL',
-                      'http://maps.google.com/maps/api/geocode')
-
 CHART_URL = getattr(settings, 'GMAPI_CHART_URL',
                     'http://chart.apis.google.com/chart')
 
 API_KEY = getattr(settings, 'GMAPI_API_KEY', None)
 
+# All MapConstants by value, so deserialized maps share them.
+_constants = {}
+
+# MarkerImages from MarkerImage.shared by their arguments.
+_sharedImages = {}
+
 
 class MapClass(dict):
     """A base class for Google Maps API classes."""
@@ -44,6 +50,16 @@ def _setMethod(key):
     return lambda self, value: self.setOptions({key: value})
 
 
+def _getId(self):
+    """Return the overlay's id (see gmapi.diffs)."""
+    return self.get('oid')
+
+
+def _setId(self, id):
+    """Give the overlay a stable id, so that it can be updated in place."""
+    self['oid'] = id
+
+
 class Map(MapClass):
     """A Google Map.
 
@@ -60,10 +76,12 @@ class Map(MapClass):
         _setMethod(k) for k in ['center', 'mapTypeId', 'zoom']
     ]
 
+    _argNames = ['mapDiv', 'opts']
+
     def __init__(self, opts=None):
         """mapDiv is not used, so not included in parameters."""
         super(Map, self).__init__(cls='Map')
-        self['arg'] = Args(['mapDiv', 'opts'], ['div'])
+        self['arg'] = Args(self._argNames, ['div'])
         self.setOptions(opts)
 
     def __unicode__(self):
@@ -91,9 +109,31 @@ class Map(MapClass):
         if 'pgn' in self:
             params.append(('path', [q for p in self['pgn']
                                     for q in unicode(p).split(u'&path=')]))
+        if 'bds' in self and not ('center' in opts or 'visible' in opts):
+            bounds = self['bds']
+            params.append(('visible', u'%s|%s' % (bounds.getSouthWest(),
+                                                  bounds.getNorthEast())))
         params.append(('sensor', u'true' if opts.get('sensor') else u'false'))
         return u'%s?%s' % (STATIC_URL, urlencode(params, doseq=True))
 
+    @classmethod
+    def from_json(cls, data, pause_gc=False):
+        """Rebuild a Map and its overlays from the output of dumps."""
+        gmap = loads(data, pause_gc)
+        if not isinstance(gmap, cls):
+            raise ValueError('Data is not a serialized %s.' % cls.__name__)
+        return gmap
+
+    def fitBounds(self, bounds):
+        """Fit the map to bounds when it is rendered.
+
+        Unlike google.maps.Map.fitBounds, this only records the
+        bounds (e.g. from geometry.computeBounds) so the jQuery
+        plugin doesn't need to compute them from every object.
+
+        """
+        self['bds'] = bounds
+
     @property
     def markers(self):
         return self.get('mkr', [])
@@ -106,6 +146,10 @@ class Map(MapClass):
     def polygons(self):
         return self.get('pgn', [])
 
+    @property
+    def layers(self):
+        return self.get('lyr', [])
+
 
 class MapConstant(MapClass):
     """A custom constant class.
@@ -118,6 +162,11 @@ class MapConstant(MapClass):
     def __init__(self, cls, const):
         super(MapConstant, self).__init__(val='%s.%s' % (cls, const))
         self.const = const
+        _constants[self['val']] = self
+
+    def __reduce__(self):
+        # Unpickle as the shared instance.
+        return _constant, (self['val'],)
 
     def __setitem__(self, key, value):
         raise KeyError(key)
@@ -126,6 +175,11 @@ class MapConstant(MapClass):
         return force_unicode(self.const.lower())
 
 
+def _constant(val):
+    """Return the MapConstant with the given value."""
+    return _constants[val]
+
+
 class MapTypeId(object):
     HYBRID, ROADMAP, SATELLITE, TERRAIN = [
         MapConstant('MapTypeId', c) for c in
@@ -166,6 +220,8 @@ class Marker(MapClass):
     converted to an actual google.maps.Marker instance.
 
     """
+    _map = _size = _color = _label = None
+
     getClickable, getCursor, getDraggable, getFlat, getIcon, getPosition, \
         getShadow, getShape, getTitle, getVisible, getZIndex \
         = [_getMethod(k) for k in
@@ -178,13 +234,17 @@ class Marker(MapClass):
            ['clickable', 'cursor', 'draggable', 'flat', 'icon', 'map',
             'position', 'shadow', 'shape', 'title', 'visible', 'zIndex']]
 
+    getId, setId = _getId, _setId
+
+    _argNames = ['opts']
+
     def __init__(self, opts=None):
         super(Marker, self).__init__(cls='Marker')
         self._map = None
         self._size = None
         self._color = None
         self._label = None
-        self['arg'] = Args(['opts'])
+        self['arg'] = Args(self._argNames)
         self.setOptions(opts)
 
     def __unicode__(self):
@@ -226,13 +286,12 @@ class Marker(MapClass):
             if (self._color or self._label) and 'icon' not in options:
                 l = self._label or u'\u2022'
                 c = (self._color or 'FF776B').lstrip('0x')
-                options['icon'] = MarkerImage('%s?chst=d_map_pin_letter'
-                                              '&chld=%s|%s' % (CHART_URL, l,
-                                                               c),
-                                              anchor=Point(10, 33))
-                options['shadow'] = MarkerImage('%s?chst=d_map_pin_shadow' %
-                                                CHART_URL, anchor=Point(12,
-                                                                        35))
+                options['icon'] = MarkerImage.shared(
+                    '%s?chst=d_map_pin_letter&chld=%s|%s' % (CHART_URL, l, c),
+                    anchor=Point(10, 33))
+                options['shadow'] = MarkerImage.shared(
+                    '%s?chst=d_map_pin_shadow' % CHART_URL,
+                    anchor=Point(12, 35))
             elif 'icon' in options:
                 self._color = None
                 self._label = None
@@ -248,11 +307,12 @@ class MarkerImage(MapClass):
     instance.
 
     """
+    _argNames = ['url', 'size', 'origin', 'anchor', 'scaledSize']
+
     def __init__(self, url, size=None, origin=None, anchor=None,
                  scaledSize=None):
         super(MarkerImage, self).__init__(cls='MarkerImage')
-        self['arg'] = Args(['url', 'size', 'origin', 'anchor', 'scaledSize'],
-                           [url])
+        self['arg'] = Args(self._argNames, [url])
         if size:
             self['arg'].setdefault('size', size)
         if origin:
@@ -265,6 +325,23 @@ class MarkerImage(MapClass):
     def __unicode__(self):
         return force_unicode(self['arg'].get('url'))
 
+    @classmethod
+    def shared(cls, url, size=None, origin=None, anchor=None,
+               scaledSize=None):
+        """Return the one MarkerImage for these arguments.
+
+        Markers that use the same image then share a single instance,
+        which therefore must not be changed.
+
+        """
+        key = (url,) + tuple(a and tuple(a['arg']) for a in
+                             (size, origin, anchor, scaledSize))
+        image = _sharedImages.get(key)
+        if image is None:
+            image = _sharedImages[key] = cls(url, size, origin, anchor,
+                                             scaledSize)
+        return image
+
 
 class Polyline(MapClass):
     """A Google Polyline.
@@ -274,16 +351,20 @@ class Polyline(MapClass):
     converted to an actual google.maps.Polyline instance.
 
     """
-    getPath = _getMethod('path')
+    _map = _path = None
 
     setMap, setPath = [
         _setMethod(k) for k in ['map', 'path']
     ]
 
+    getId, setId = _getId, _setId
+
+    _argNames = ['opts']
+
     def __init__(self, opts=None):
         super(Polyline, self).__init__(cls='Polyline')
         self._map = None
-        self['arg'] = Args(['opts'])
+        self['arg'] = Args(self._argNames)
         self.setOptions(opts)
 
     def __unicode__(self):
@@ -297,14 +378,35 @@ class Polyline(MapClass):
             params.append(color)
         if 'strokeWeight' in opts:
             params.append(u'weight:%d' % opts['strokeWeight'])
-        if 'path' in opts:
-            params.append(u'|'.join([unicode(p) for p in opts['path']]))
+        path = self.getPath()
+        if path is not None:
+            params.append(u'|'.join([unicode(p) for p in path]))
         return u'|'.join(params)
 
     def getMap(self):
         return self._map
 
+    def getPath(self):
+        return self['arg'].get('opts', {}).get('path', self._path)
+
+    def setLevelsOfDetail(self, zooms=None, pixels=1):
+        """Send a simplified path for each band of zoom levels.
+
+        The jQuery plugin switches between them as the map is zoomed
+        (see geometry.levelsOfDetail). The full path is then only
+        kept on the server, e.g. for static maps.
+
+        """
+        lod = _levelsOfDetail([self.getPath() or []], zooms, pixels)
+        if lod:
+            self['lod'] = [[zoom, paths[0]] for zoom, paths in lod]
+            self._path = self['arg'].get('opts', {}).pop('path', self._path)
+
     def setOptions(self, options):
+        if options and 'path' in options:
+            # A new path makes the levels of detail outdated.
+            self._path = None
+            self.pop('lod', None)
         if options and 'map' in options:
             if self._map:
                 # Remove this polyline from the map.
@@ -325,16 +427,20 @@ class Polygon(MapClass):
     converted to an actual google.maps.Polygon instance.
 
     """
-    getPaths = _getMethod('paths')
+    _map = _paths = None
 
     setMap, setPaths = [
         _setMethod(k) for k in ['map', 'paths']
     ]
 
+    getId, setId = _getId, _setId
+
+    _argNames = ['opts']
+
     def __init__(self, opts=None):
         super(Polygon, self).__init__(cls='Polygon')
         self._map = None
-        self['arg'] = Args(['opts'])
+        self['arg'] = Args(self._argNames)
         self.setOptions(opts)
 
     def __unicode__(self):
@@ -356,8 +462,8 @@ class Polygon(MapClass):
             params.append(color)
         if 'strokeWeight' in opts:
             params.append(u'weight:%d' % opts['strokeWeight'])
-        if 'paths' in opts:
-            for path in opts['paths']:
+        if self.getPaths() is not None:
+            for path in self.getPaths():
                 loop = [u'' if path[-1].equals(path[0]) else unicode(path[0])]
                 paths.append(u'|'.join(params + [unicode(p) for p in path] +
                                        loop))
@@ -369,7 +475,27 @@ class Polygon(MapClass):
     def getPath(self):
         return (self.getPaths() or [None])[0]
 
+    def getPaths(self):
+        return self['arg'].get('opts', {}).get('paths', self._paths)
+
+    def setLevelsOfDetail(self, zooms=None, pixels=1):
+        """Send simplified paths for each band of zoom levels.
+
+        See Polyline.setLevelsOfDetail.
+
+        """
+        lod = _levelsOfDetail(self.getPaths() or [], zooms, pixels)
+        if lod:
+            # Without any paths there is nothing to switch between.
+            self['lod'] = lod
+            self._paths = self['arg'].get('opts', {}).pop('paths',
+                                                          self._paths)
+
     def setOptions(self, options):
+        if options and 'paths' in options:
+            # New paths make the levels of detail outdated.
+            self._paths = None
+            self.pop('lod', None)
         if options and 'map' in options:
             if self._map:
                 # Remove this polygon from the map.
@@ -385,6 +511,67 @@ class Polygon(MapClass):
         self.setPaths([path])
 
 
+def _levelsOfDetail(paths, zooms, pixels):
+    """Return [zoom, encoded paths] for the zoom bands of paths.
+
+    Bands that would repeat the paths of the previous one are left
+    out.
+
+    """
+    from gmapi import geometry
+    zooms = zooms or geometry.LOD_ZOOMS
+    bands = zip(*[geometry.levelsOfDetail(path, zooms, pixels)
+                  for path in paths])
+    lod = []
+    for zoom, band in zip(zooms, bands):
+        encoded = [geometry.encoding.encodePath(path) for path in band]
+        if not lod or encoded != lod[-1][1]:
+            lod.append([zoom, encoded])
+    return lod
+
+
+class HeatmapLayer(MapClass):
+    """A Google HeatmapLayer.
+
+    Equivalent to google.maps.visualization.HeatmapLayer. When parsed
+    by JSONEncoder and subsequently by our custom jQuery plugin, it
+    will be converted to an actual HeatmapLayer instance. This needs
+    the visualization library, so add '&libraries=visualization' to
+    GMAPI_MAPS_URL.
+
+    """
+    _map = None
+
+    getData = _getMethod('data')
+
+    setData, setMap = [
+        _setMethod(k) for k in ['data', 'map']
+    ]
+
+    _argNames = ['opts']
+
+    def __init__(self, opts=None):
+        super(HeatmapLayer, self).__init__(cls='visualization.HeatmapLayer')
+        self._map = None
+        self['arg'] = Args(self._argNames)
+        self.setOptions(opts)
+
+    def getMap(self):
+        return self._map
+
+    def setOptions(self, options):
+        if options and 'map' in options:
+            if self._map:
+                # Remove this layer from the map.
+                self._map['lyr'].remove(self)
+            # Save new map reference.
+            self._map = options.pop('map')
+            if self._map:
+                # Add this layer to the map.
+                self._map.setdefault('lyr', []).append(self)
+        super(HeatmapLayer, self).setOptions(options)
+
+
 class InfoWindow(MapClass):
     """A Google InfoWindow.
 
@@ -403,9 +590,11 @@ class InfoWindow(MapClass):
         ['content', 'position', 'zIndex']
     ]
 
+    _argNames = ['opts']
+
     def __init__(self, opts=None):
         super(InfoWindow, self).__init__(cls='InfoWindow')
-        self['arg'] = Args(['opts'])
+        self['arg'] = Args(self._argNames)
         self.setOptions(opts)
 
     def open(self, map, anchor=None):
@@ -451,11 +640,12 @@ class Geocoder(object):
     limits are per IP. The javascript API uses the client's IP
     and thus is much less likely to hit any limits.
 
+    Requests are answered by a backend (see gmapi.geocoders), which
+    defaults to the GMAPI_GEOCODER_BACKEND setting.
+
     """
-    # Handle blocking and sleeping at class level.
-    _block = False
-    _sleep = 0
-    _last = 0
+    def __init__(self, backend=None):
+        self.backend = backend or get_backend()
 
     def geocode(self, request, callback=None):
         """Geocode a request.
@@ -480,49 +670,21 @@ class Geocoder(object):
         if API_KEY is not None and 'key' not in request:
             request['key'] = API_KEY
 
-        cache_key = urlencode(request)
-        url = '%s/json?%s' % (GEOCODE_URL, cache_key)
-        # Try up to 30 times if over query limit.
-        for _ in xrange(30):
-            # Check if result is already cached.
-            data = cache.get(cache_key)
-            if data is None:
-                if (max(0, time.time() - self.__class__._last) <
-                        self.__class__._sleep):
-                    # Wait a bit so that we don't make requests too fast.
-                    time.sleep(max(0, self.__class__._sleep +
-                                   self.__class__._last - time.time()))
-                data = urllib.urlopen(url).read()
-                self.__class__._last = time.time()
-            response = loads(data)
-            status = response['status']
-
-            if status == 'OVER_QUERY_LIMIT':
-                # Over limit, increase delay a bit.
-                if self.__class__._block:
-                    break
-                self.__class__._sleep += .1
-            else:
-                # Save results to cache.
-                cache.set(cache_key, data)
-                if status == 'OK':
-                    # Successful query, clear block if there is one.
-                    if self.__class__._block:
-                        self.__class__._block = False
-                        self.__class__._sleep = 0
-                    results = _parseGeocoderResult(response['results'])
-                    if callback:
-                        callback(results, status)
-                    return results, status
-                else:
-                    return None, status
-        self.__class__._block = True
-        raise SystemError('Geocoding has failed too many times. '
-                          'You might have exceeded your daily limit.')
+        response = self.backend.geocode(request)
+        if response is None:
+            # The backend has no answer for this request.
+            return None, 'ZERO_RESULTS'
+        status = response['status']
+        if status == 'OK':
+            results = _parseGeocoderResult(response['results'])
+            if callback:
+                callback(results, status)
+            return results, status
+        return None, status
 
 
 class MapsEventListener(list):
-    pass
+    __slots__ = ('instance',)
 
 
 class event(object):
@@ -573,10 +735,11 @@ class LatLng(MapClass):
     converted to an actual google.maps.LatLng instance.
 
     """
+    _argNames = ['lat', 'lng', 'noWrap']
+
     def __init__(self, lat, lng, noWrap=None):
         super(LatLng, self).__init__(cls='LatLng')
-        self['arg'] = Args(['lat', 'lng', 'noWrap'], [Degree(lat),
-                                                      Degree(lng)])
+        self['arg'] = Args(self._argNames, [Degree(lat), Degree(lng)])
         if noWrap is not None:
             self['arg'].setdefault('noWrap', noWrap)
 
@@ -609,9 +772,11 @@ class LatLngBounds(MapClass):
     instance.
 
     """
+    _argNames = ['sw', 'ne']
+
     def __init__(self, sw=None, ne=None):
         super(LatLngBounds, self).__init__(cls='LatLngBounds')
-        self['arg'] = Args(['sw', 'ne'])
+        self['arg'] = Args(self._argNames)
         if sw:
             self['arg'].setdefault('sw', sw)
         if ne:
@@ -620,23 +785,81 @@ class LatLngBounds(MapClass):
     def __unicode__(self):
         return force_unicode(self.toUrlValue())
 
+    def contains(self, latLng):
+        if self.isEmpty():
+            return False
+        sw, ne = self.getSouthWest(), self.getNorthEast()
+        return (sw.lat() <= latLng.lat() <= ne.lat() and
+                _lngContains(sw.lng(), ne.lng(), latLng.lng()))
+
     def equals(self, other):
         # Check if our corners are equal.
         return (self.getSouthWest().equals(other.getSouthWest()) and
                 self.getNorthEast().equals(other.getNorthEast()))
 
+    def extend(self, point):
+        """Grow the bounds to include point and return them.
+
+        New LatLng corners are created, so any LatLng the bounds
+        were built from is left untouched.
+
+        """
+        if self.isEmpty():
+            south = north = point.lat()
+            west = east = point.lng()
+        else:
+            sw, ne = self.getSouthWest(), self.getNorthEast()
+            south = min(sw.lat(), point.lat())
+            north = max(ne.lat(), point.lat())
+            west, east = sw.lng(), ne.lng()
+            lng = point.lng()
+            if not _lngContains(west, east, lng):
+                # Grow towards whichever side is closer.
+                if (west - lng) % 360 < (lng - east) % 360:
+                    west = lng
+                else:
+                    east = lng
+        self['arg'][:] = [LatLng(south, west), LatLng(north, east)]
+        return self
+
+    def getCenter(self):
+        if self.isEmpty():
+            return LatLng(0, 0)
+        sw, ne = self.getSouthWest(), self.getNorthEast()
+        west, east = sw.lng(), ne.lng()
+        if west > east:
+            east += 360
+        lng = (west + east) / 2.0
+        return LatLng((sw.lat() + ne.lat()) / 2.0,
+                      lng - 360 if lng >= 180 else lng)
+
     def getNorthEast(self):
         return self['arg'].get('ne')
 
     def getSouthWest(self):
         return self['arg'].get('sw')
 
+    def intersects(self, other):
+        if self.isEmpty() or other.isEmpty():
+            return False
+        sw, ne = self.getSouthWest(), self.getNorthEast()
+        osw, one = other.getSouthWest(), other.getNorthEast()
+        return (sw.lat() <= one.lat() and osw.lat() <= ne.lat() and
+                (_lngContains(sw.lng(), ne.lng(), osw.lng()) or
+                 _lngContains(osw.lng(), one.lng(), sw.lng())))
+
     def isEmpty(self):
         return ((not self.getSouthWest()) or
                 (self.getNorthEast() and
                  self.getSouthWest().lat() >
                  self.getNorthEast().lat()))
 
+    def toSpan(self):
+        if self.isEmpty():
+            return LatLng(0, 0)
+        sw, ne = self.getSouthWest(), self.getNorthEast()
+        return LatLng(ne.lat() - sw.lat(), _lngSpan(sw.lng(), ne.lng()))
+
     def toString(self):
         return '(%s, %s)' % (self.getSouthWest().toString(),
                              self.getNorthEast().toString())
@@ -645,6 +868,59 @@ class LatLngBounds(MapClass):
         return '%s,%s' % (self.getSouthWest().toUrlValue(precision),
                           self.getNorthEast().toUrlValue(precision))
 
+    def union(self, other):
+        """Grow the bounds to include other and return them."""
+        if other.isEmpty():
+            return self
+        osw, one = other.getSouthWest(), other.getNorthEast()
+        if self.isEmpty():
+            south, north = osw.lat(), one.lat()
+            west, east = osw.lng(), one.lng()
+        else:
+            sw, ne = self.getSouthWest(), self.getNorthEast()
+            south, north = min(sw.lat(), osw.lat()), max(ne.lat(), one.lat())
+            west, east = _lngUnion(sw.lng(), ne.lng(), osw.lng(), one.lng())
+        self['arg'][:] = [LatLng(south, west), LatLng(north, east)]
+        return self
+
+
+def _lngContains(west, east, lng):
+    """Check if lng lies in the interval from west to east.
+
+    The interval crosses the antimeridian when west > east.
+
+    """
+    if west <= east:
+        return west <= lng <= east
+    return lng >= west or lng <= east
+
+
+def _lngSpan(west, east):
+    """Return the width in degrees of a longitude interval."""
+    return east - west if west <= east else east - west + 360
+
+
+def _lngUnion(west, east, owest, oeast):
+    """Return the smallest longitude interval containing both intervals."""
+    span, ospan = _lngSpan(west, east), _lngSpan(owest, oeast)
+    if (owest - west) % 360 + ospan <= span:
+        return west, east
+    if (west - owest) % 360 + span <= ospan:
+        return owest, oeast
+    hasWest = _lngContains(west, east, owest)
+    hasEast = _lngContains(west, east, oeast)
+    if hasWest and hasEast:
+        # Together they cover the whole circle.
+        return -180, 180
+    if hasWest:
+        return west, oeast
+    if hasEast:
+        return owest, east
+    # Disjoint: join them across the shorter gap.
+    if (owest - east) % 360 < (west - oeast) % 360:
+        return west, oeast
+    return owest, east
+
 
 class Point(MapClass):
     """A point on a two-dimensional plane.
@@ -654,9 +930,11 @@ class Point(MapClass):
     converted to an actual google.maps.Point instance.
 
     """
+    _argNames = ['x', 'y']
+
     def __init__(self, x, y):
         super(Point, self).__init__(cls='Point')
-        self['arg'] = Args(['x', 'y'], [x, y])
+        self['arg'] = Args(self._argNames, [x, y])
 
     def __unicode__(self):
         return u'%s,%s' % (self['arg'].get('x', 0), self['arg'].get('y', 0))
@@ -692,10 +970,11 @@ class Size(MapClass):
     converted to an actual google.maps.Size instance.
 
     """
+    _argNames = ['width', 'height', 'widthUnit', 'heightUnit']
+
     def __init__(self, width, height, widthUnit=None, heightUnit=None):
         super(Size, self).__init__(cls='Size')
-        self['arg'] = Args(['width', 'height', 'widthUnit', 'heightUnit'],
-                           [int(width), int(height)])
+        self['arg'] = Args(self._argNames, [int(width), int(height)])
         if widthUnit:
             self['arg'].setdefault('widthUnit', widthUnit)
         if heightUnit:
@@ -736,11 +1015,14 @@ class Degree(float):
     will output with, at most, the specified precision.
 
     """
-    def __new__(cls, value, precision=6):
-        return float.__new__(cls, value)
+    precision = 6
 
-    def __init__(self, value, precision=6):
-        self.precision = precision
+    def __new__(cls, value, precision=6):
+        self = float.__new__(cls, value)
+        if precision != 6:
+            # Most have the default, which saves them an instance dict.
+            self.precision = precision
+        return self
 
     def __repr__(self):
         return (('%%0.%df' % self.precision) % self).rstrip('0').rstrip('.')
@@ -754,8 +1036,10 @@ class Degree(float):
 
 class Args(list):
     """A custom list that implements setdefault and get by name."""
+    __slots__ = ('names',)
+
     def __init__(self, names, values=None):
-        super(Args, self).__init__(values or [])
+        list.__init__(self, values or ())
         self.names = names
 
     def get(self, name, default=None):
@@ -769,3 +1053,242 @@ class Args(list):
             self.extend(None for _ in xrange(len(self), i))
             self.append(default)
         return self[i]
+
+
+def dumps(obj, binary=False, styles=False):
+    """Serialize a map object graph.
+
+    By default this is the compact JSON that the jQuery plugin
+    parses. With styles, each distinct marker icon and shadow of a
+    Map is written once, to a style table ('sty') that the markers
+    refer to by index.
+
+    With binary, it is a zlib compressed marshal dump in which equal
+    Points, Sizes and MarkerImages are stored only once. That is
+    meant for caching: it is much smaller and faster to load than
+    JSON, but can only be read by the same Python version and must
+    never come from an untrusted source.
+
+    """
+    if binary:
+        table = []
+        tree = _freeze(obj, table, {})
+        return zlib.compress(marshal.dumps((table, tree), 2))
+    if styles and isinstance(obj, Map) and 'mkr' in obj:
+        obj = _styleTable(obj)
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def _styleTable(gmap):
+    """Return a copy of gmap with its marker images in a style table."""
+    table, index, refs = [], {}, {}
+    markers = []
+    for marker in gmap['mkr']:
+        opts = marker['arg'].get('opts', {})
+        images = {}
+        for key in ('icon', 'shadow'):
+            image = opts.get(key)
+            if not isinstance(image, MarkerImage):
+                continue
+            if id(image) not in refs:
+                # Equal images that aren't shared still get one entry.
+                data = json.dumps(image, sort_keys=True)
+                if data not in index:
+                    index[data] = {'sty': len(table)}
+                    table.append(image)
+                refs[id(image)] = index[data]
+            images[key] = refs[id(image)]
+        if images:
+            marker = dict(marker, arg=[dict(opts, **images)])
+        markers.append(marker)
+    return dict(gmap, mkr=markers, sty=table)
+
+
+def loads(data, pause_gc=False):
+    """Rebuild a map object graph from the output of dumps.
+
+    Overlays are added back to their maps, info windows and event
+    listeners are reattached and constants are the shared
+    MapConstant instances. The static map settings that aren't part
+    of the JSON (such as a marker's size) can't be restored. Neither
+    can the full paths of overlays with levels of detail: from JSON
+    they come back from the encoded paths, rounded to 5 decimals.
+    The binary format keeps them.
+
+    Creating many objects runs the cyclic garbage collector over and
+    over. With pause_gc, it is disabled while loading, which is faster
+    for big maps but also pauses it for every other thread.
+
+    """
+    if not pause_gc:
+        return _loads(data)
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _loads(data)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _loads(data):
+    # JSON can't start with 'x' but a zlib stream always does.
+    if data[:1] != 'x':
+        return json.loads(data, object_hook=partial(_restore, {}))
+    table, tree = marshal.loads(zlib.decompress(data))
+    shared, memo = [], {}
+    for item in table:
+        shared.append(_thaw(item, shared, memo))
+    return _thaw([tree], shared, memo)[0]
+
+
+def _freeze(obj, table, index):
+    """Convert obj to plain containers for marshal.
+
+    Shared classes are appended to table (once per distinct value)
+    and replaced by a 1-tuple holding their position in it. Plain
+    LatLngs become (lat, lng) tuples.
+
+    """
+    if isinstance(obj, dict):
+        if id(obj) in index:
+            return index[id(obj)]
+        if type(obj) is LatLng and len(obj) == 2 and len(obj['arg']) == 2:
+            return float(obj['arg'][0]), float(obj['arg'][1])
+        plain = dict((k, _freeze(v, table, index)) for k, v in obj.iteritems()
+                     if k != 'evt')
+        if 'evt' in obj:
+            # Tuples of strings are soon ignored by the garbage collector.
+            plain['evt'] = tuple(tuple(listener) for listener in obj['evt'])
+        if type(obj) in _sharedClasses and len(obj) == 2:
+            key = (plain['cls'], tuple(plain['arg']))
+            if key not in index:
+                index[key] = (len(table),)
+                table.append(plain)
+            plain = index[id(obj)] = index[key]
+        elif 'lod' in obj:
+            # Keep the full path(s), which the encoded levels round.
+            full = obj._path if isinstance(obj, Polyline) else obj._paths
+            plain['pth'] = _freeze(full, table, index)
+        return plain
+    if isinstance(obj, (list, tuple)):
+        return [_freeze(v, table, index) for v in obj]
+    if isinstance(obj, float):
+        return float(obj)
+    return obj
+
+
+def _thaw(obj, shared, memo):
+    """Restore the output of _freeze in place."""
+    isList = type(obj) is list
+    for k, v in enumerate(obj) if isList else obj.iteritems():
+        kind = type(v)
+        if k == 'evt':
+            # Plain listeners, which _restore wraps.
+            continue
+        if kind is tuple:
+            obj[k] = shared[v[0]] if len(v) == 1 else _latLng(*v)
+        elif kind is dict or kind is list:
+            obj[k] = _thaw(v, shared, memo)
+    return obj if isList else _restore(memo, obj)
+
+
+def _latLng(lat, lng):
+    """Return a LatLng, without the overhead of its constructor."""
+    latLng = LatLng.__new__(LatLng)
+    latLng['cls'] = 'LatLng'
+    latLng['arg'] = Args(LatLng._argNames, [Degree(lat), Degree(lng)])
+    return latLng
+
+
+_pinLetter = re.compile(r'chst=d_map_pin_letter&chld=([^|]*)\|(.*)$')
+
+
+def _restore(shared, d):
+    """Turn a decoded JSON object back into the instance it came from.
+
+    Used as a JSONDecoder object_hook, so the children of d have
+    already been restored. Constructors are bypassed since the
+    serialized arguments and options are already complete. Equal
+    Points, Sizes and MarkerImages become one shared instance. The
+    shared dict is kept for the whole graph.
+
+    """
+    cls = _classes.get(d.get('cls'))
+    if cls is None:
+        return _constants.get(d['val'], d) if 'val' in d else d
+    if cls is LatLng and len(d) == 2 and len(d['arg']) == 2:
+        # By far the most common object, so skip the checks below.
+        return _latLng(*d['arg'])
+    if cls in _sharedClasses:
+        # Their children are shared as well, so ids identify them.
+        key = (cls,) + tuple(id(a) if isinstance(a, dict) else a
+                             for a in d['arg'])
+        if key in shared:
+            return shared[key]
+    obj = cls.__new__(cls)
+    dict.update(obj, d)
+    args = d.get('arg')
+    if args is not None:
+        if cls is LatLng:
+            args[0], args[1] = Degree(args[0]), Degree(args[1])
+        obj['arg'] = Args(cls._argNames, args)
+    if cls is Map:
+        for key in ('mkr', 'pln', 'pgn', 'lyr'):
+            for overlay in d.get(key, ()):
+                overlay._map = obj
+        if 'sty' in obj:
+            # Replace the references to the style table.
+            table = obj.pop('sty')
+            for marker in obj['mkr']:
+                opts = marker['arg'].get('opts', {})
+                for key in ('icon', 'shadow'):
+                    if 'sty' in opts.get(key, ()):
+                        opts[key] = table[opts[key]['sty']]
+                _restorePin(shared, marker)
+    elif cls is Marker:
+        _restorePin(shared, obj)
+    elif 'pth' in obj:
+        # The full path(s) of a binary dump.
+        if cls is Polyline:
+            obj._path = obj.pop('pth')
+        else:
+            obj._paths = obj.pop('pth')
+    elif 'lod' in obj:
+        # Only the levels of detail of the path(s) were serialized.
+        from gmapi.geometry import encoding
+        paths = obj['lod'][-1][1]
+        if cls is Polyline:
+            obj._path = encoding.decodePath(paths)
+        else:
+            obj._paths = [encoding.decodePath(path) for path in paths]
+    elif cls in _sharedClasses:
+        shared[key] = obj
+    if 'evt' in d:
+        obj['evt'] = [MapsEventListener(listener) for listener in d['evt']]
+        for listener in obj['evt']:
+            listener.instance = obj
+    return obj
+
+
+def _restorePin(shared, marker):
+    """Recover the color and label of a marker's generated pin."""
+    icon = marker.getIcon()
+    if not isinstance(icon, MarkerImage):
+        return
+    url = icon['arg'][0]
+    if url not in shared:
+        match = _pinLetter.search(url)
+        shared[url] = match and match.groups()
+    if shared[url]:
+        label, marker._color = shared[url]
+        marker._label = label if label != u'\u2022' else None
+
+
+_classes = dict((cls.__name__, cls) for cls in
+                [InfoWindow, LatLng, LatLngBounds, Map, Marker, MarkerImage,
+                 Point, Polygon, Polyline, Size])
+
+_classes['visualization.HeatmapLayer'] = HeatmapLayer
+
+_sharedClasses = frozenset([MarkerImage, Point, Size])
@@ -25,6 +25,28 @@
         }
     }
 
+    // Instances of these classes never change after construction, so
+    // identical ones are shared instead of being constructed again.
+    var sharedClasses = {MarkerImage: true};
+    var shared = {};
+
+    // Names of the div data holding each kind of map object.
+    var overlays = {mkr: 'markers', pln: 'polylines', pgn: 'polygons',
+                    lyr: 'layers'};
+
+    // Call fn on the next idle period (or animation frame).
+    function defer(fn) {
+        if (window.requestIdleCallback) {
+            window.requestIdleCallback(fn, {timeout: 100});
+        }
+        else if (window.requestAnimationFrame) {
+            window.requestAnimationFrame(fn);
+        }
+        else {
+            setTimeout(fn, 0);
+        }
+    }
+
     // Link an InfoWindow to a Map or Marker.
     // Adds 3 new functions to the Map or Marker:
     //   openInfoWindow, closeInfoWindow, and getInfoWindow
@@ -80,30 +102,44 @@
     //     evt  Associated Maps Event Listeners for class constructor.
     //   div    Placeholder for DOM node.
     //   val    The name of a property or constant (descendant of google.maps).
-    function parse(obj, div) {
+    //   sty    Index of an object in the map's style table (styles).
+    function parse(obj, div, styles) {
         // Handle a div.
         if (obj === 'div') {
             return div;
         }
         if ($.isPlainObject(obj) || $.isArray(obj)) {
+            // Handle a style table reference.
+            if (styles && typeof obj.sty === 'number') {
+                return styles[obj.sty];
+            }
             // Handle a new class instance.
             if (obj.cls) {
+                // Handle a shared instance.
+                var key = sharedClasses[obj.cls] && window.JSON &&
+                    obj.cls + JSON.stringify(obj.arg);
+                if (key && key in shared) {
+                    return shared[key];
+                }
                 // Handle initialization parameters.
                 var args = [];
                 if (obj.arg) {
                     for (var a in obj.arg) {
-                        args.push(parse(obj.arg[a], div));
+                        args.push(parse(obj.arg[a], div, styles));
                     }
                 }
                 var o = instance(property(obj.cls), args);
                 // Handle an associated InfoWindow.
                 if (obj.nfo) {
-                    linkInfo(o, parse(obj.nfo, div));
+                    linkInfo(o, parse(obj.nfo, div, styles));
                 }
                 // Handle events.
                 if (obj.evt) {
                     addEvents(o, obj.evt);
                 }
+                if (key) {
+                    shared[key] = o;
+                }
                 return o;
             }
             // Handle a property or constant.
@@ -112,12 +148,80 @@
             }
             // Handle any other iterable.
             for (var k in obj) {
-                obj[k] = parse(obj[k], div);
+                obj[k] = parse(obj[k], div, styles);
             }
         }
         return obj;
     }
 
+    // Decode a path in the Encoded Polyline Algorithm Format.
+    function decodePath(encoded) {
+        var path = [];
+        var values = [0, 0];
+        var value = 0, shift = 0, i = 0;
+        for (var k = 0; k < encoded.length; k++) {
+            var b = encoded.charCodeAt(k) - 63;
+            value |= (b & 0x1f) << shift;
+            shift += 5;
+            if (b < 0x20) {
+                values[i] += value & 1 ? ~(value >> 1) : value >> 1;
+                value = shift = 0;
+                i = 1 - i;
+                if (!i) {
+                    path.push(new google.maps.LatLng(values[0] / 1e5,
+                                                     values[1] / 1e5));
+                }
+            }
+        }
+        return path;
+    }
+
+    // Show the path(s) of a Polyline or Polygon for the map's zoom level.
+    // lod is a list of [first zoom level, encoded path(s)], see
+    // Polyline.setLevelsOfDetail. Paths are decoded when first needed.
+    function useLevels(object, lod, map) {
+        var paths = [];
+        var current = -1;
+        var update = function() {
+            var zoom = map.getZoom();
+            var band = 0;
+            while (band + 1 < lod.length && lod[band + 1][0] <= zoom) {
+                band++;
+            }
+            if (band === current) {
+                return;
+            }
+            current = band;
+            if (!paths[band]) {
+                if (object instanceof google.maps.Polygon) {
+                    paths[band] = $.map(lod[band][1], function(p) {
+                        return [decodePath(p)];
+                    });
+                }
+                else {
+                    paths[band] = decodePath(lod[band][1]);
+                }
+            }
+            if (object instanceof google.maps.Polygon) {
+                object.setPaths(paths[band]);
+            }
+            else {
+                object.setPath(paths[band]);
+            }
+        };
+        update();
+        object.gmapiLevels = google.maps.event.addListener(map,
+            'zoom_changed', update);
+    }
+
+    // Stop switching the paths of an object.
+    function dropLevels(object) {
+        if (object.gmapiLevels) {
+            google.maps.event.removeListener(object.gmapiLevels);
+            delete object.gmapiLevels;
+        }
+    }
+
     // Converts collections of LatLng coordinates to a LatLngBounds.
     // Traverses markers and polyline/polygon paths.
     function toBounds(obj) {
@@ -140,6 +244,10 @@
         else if (obj instanceof google.maps.Polygon) {
             bounds.union(toBounds(obj.getPaths()));
         }
+        else if (google.maps.visualization &&
+                obj instanceof google.maps.visualization.HeatmapLayer) {
+            bounds.union(toBounds(obj.getData()));
+        }
         return bounds;
     }
 
@@ -152,35 +260,103 @@
             for (var o in objects) {
                 // Clear it from the map.
                 objects[o].setMap(null);
+                dropLevels(objects[o]);
             }
             // Remove from div data.
             div.removeData(name);
+            div.removeData(name + 'ById');
         };
     }
 
     // Add and render an array of objects.
-    function addObjects(name, obj) {
+    // Options:
+    //   chunked    Create the objects in time slices instead of all at once,
+    //              triggering 'gmapi-progress' (name, done, total) after
+    //              each slice.
+    //   chunkTime  Milliseconds to spend per slice (default 10).
+    //   complete   Called (with the div as this) once all objects are added,
+    //              right after 'gmapi-complete' (name) is triggered.
+    function addObjects(name, obj, options) {
+        options = options || {};
         return function() {
             if (obj) {
+                var self = this;
                 var div = $(this);
                 // Get a map reference.
                 var map = div.data('map');
                 // Get any existing objects.
                 var objects = div.data(name) || [];
-                for (var o in obj) {
+                // Objects with an id (see gmapi.diffs) by id.
+                var ids = div.data(name + 'ById') || {};
+                // Save the marker array to div data.
+                div.data(name, objects);
+                div.data(name + 'ById', ids);
+                var i = 0;
+                var add = function() {
+                    var data = obj[i++];
                     // Parse the marker.
-                    var object = parse(obj[o], this);
+                    var object = parse(data, self, div.data('styles'));
                     // Render it to the map.
                     object.setMap(map);
+                    // Switch its path(s) with the zoom level.
+                    if (data.lod && data.lod.length) {
+                        useLevels(object, data.lod, map);
+                    }
                     // Add the marker to our array.
                     objects.push(object);
+                    if (data.oid != null) {
+                        object.gmapiId = data.oid;
+                        ids[data.oid] = object;
+                    }
+                };
+                var done = function() {
+                    div.trigger('gmapi-complete', [name]);
+                    if (options.complete) {
+                        options.complete.call(self);
+                    }
+                };
+                if (!options.chunked) {
+                    while (i < obj.length) {
+                        add();
+                    }
+                    done();
+                    return;
                 }
-                // Save the marker array to div data.
-                div.data(name, objects);
+                var slice = function() {
+                    // Stop if the objects were removed in the meantime.
+                    if (div.data(name) !== objects) {
+                        return;
+                    }
+                    var end = new Date().getTime() + (options.chunkTime || 10);
+                    while (i < obj.length && new Date().getTime() < end) {
+                        add();
+                    }
+                    div.trigger('gmapi-progress', [name, i, obj.length]);
+                    if (i < obj.length) {
+                        defer(slice);
+                    }
+                    else {
+                        done();
+                    }
+                };
+                defer(slice);
             }
         };
     }
 
+    // Fit the map to a LatLngBounds.
+    function fitBounds(map, bounds, zoom) {
+        if (zoom >= 0) {
+            // Zoom specified: center map to the bounds.
+            map.setZoom(zoom);
+            map.setCenter(bounds.getCenter());
+        }
+        else {
+            // No zoom: fit map to the bounds.
+            map.fitBounds(bounds);
+        }
+    }
+
     // Fit the map to the objects.
     function fitObjects(name, zoom) {
         return function() {
@@ -190,20 +366,136 @@
             // Get any existing objects.
             var objects = div.data(name);
             if (map && objects) {
-                var bounds = toBounds(objects);
-                if (zoom >= 0) {
-                    // Zoom specified: center map to the bounds.
-                    map.setZoom(zoom);
-                    map.setCenter(bounds.getCenter());
+                fitBounds(map, toBounds(objects), zoom);
+            }
+        };
+    }
+
+    // Initialize maps once they come within margin pixels of the viewport.
+    // The static map image stays in place until then.
+    function lazyInit(divs, margin) {
+        if (window.IntersectionObserver) {
+            var observer = new IntersectionObserver(function(entries) {
+                $.each(entries, function() {
+                    if (this.isIntersecting) {
+                        observer.unobserve(this.target);
+                        $(this.target).initMap();
+                    }
+                });
+            }, {rootMargin: margin + 'px'});
+            divs.each(function() {
+                observer.observe(this);
+            });
+        }
+        else {
+            // Fallback: check positions on (throttled) scroll and resize.
+            var win = $(window);
+            var pending = divs;
+            var timer = null;
+            var check = function() {
+                timer = null;
+                var top = win.scrollTop() - margin;
+                var bottom = win.scrollTop() + win.height() + margin;
+                pending = pending.filter(function() {
+                    var div = $(this);
+                    var offset = div.offset().top;
+                    if (offset < bottom && offset + div.height() > top) {
+                        div.initMap();
+                        return false;
+                    }
+                    return true;
+                });
+                if (!pending.length) {
+                    win.unbind('scroll resize', schedule);
                 }
-                else {
-                    // No zoom: fit map to the bounds.
-                    map.fitBounds(bounds);
+            };
+            var schedule = function() {
+                if (!timer) {
+                    timer = setTimeout(check, 100);
+                }
+            };
+            win.bind('scroll resize', schedule);
+            check();
+        }
+    }
+
+    // Remove the objects with the given ids.
+    function removeIds(name, remove) {
+        return function() {
+            var div = $(this);
+            var objects = div.data(name) || [];
+            var ids = div.data(name + 'ById') || {};
+            var removed = {};
+            for (var r in remove) {
+                var object = ids[remove[r]];
+                if (object) {
+                    object.setMap(null);
+                    dropLevels(object);
+                    delete ids[remove[r]];
+                    removed[remove[r]] = object;
+                }
+            }
+            // Shrink the array in place, since a chunked addObjects may
+            // still be filling it.
+            var j = 0;
+            for (var i = 0; i < objects.length; i++) {
+                var id = objects[i].gmapiId;
+                if (!(id in removed && removed[id] === objects[i])) {
+                    objects[j++] = objects[i];
+                }
+            }
+            objects.length = j;
+        };
+    }
+
+    // Update the map and its objects in place from the output of
+    // gmapi.diffs.diff: map options first, then for each kind of object
+    // removals, option changes and additions (with addObjects options).
+    function applyDiff(diff, options) {
+        return function() {
+            var div = $(this);
+            var map = div.data('map');
+            if (!map || !diff) {
+                return;
+            }
+            if (diff.opt) {
+                map.setOptions(parse(diff.opt, this));
+            }
+            if (diff.bds) {
+                fitBounds(map, parse(diff.bds), map.getZoom());
+            }
+            for (var k in overlays) {
+                var part = diff[k];
+                if (!part) {
+                    continue;
+                }
+                if (part.rm) {
+                    removeIds(overlays[k], part.rm).call(this);
+                }
+                var ids = div.data(overlays[k] + 'ById') || {};
+                for (var id in part.chg) {
+                    if (ids[id]) {
+                        ids[id].setOptions(parse(part.chg[id], this,
+                                                 div.data('styles')));
+                    }
+                }
+                if (part.add) {
+                    addObjects(overlays[k], part.add, options).call(this);
                 }
             }
         };
     }
 
+    // Auto-size map to the objects if no center or zoom given.
+    function autoFit(name) {
+        return function() {
+            var map = $(this).data('map');
+            if (!map.getCenter()) {
+                fitObjects(name, map.getZoom()).call(this);
+            }
+        };
+    }
+
     // Add our custom methods to jQuery.
     $.fn.extend({
         removeMarkers: function() {
@@ -215,14 +507,20 @@
         removePolygons: function() {
             return this.each(removeObjects('polygons'));
         },
-        addMarkers: function(obj) {
-            return this.each(addObjects('markers', obj));
+        removeLayers: function() {
+            return this.each(removeObjects('layers'));
         },
-        addPolylines: function(obj) {
-            return this.each(addObjects('polylines', obj));
+        addMarkers: function(obj, options) {
+            return this.each(addObjects('markers', obj, options));
         },
-        addPolygons: function(obj) {
-            return this.each(addObjects('polygons', obj));
+        addPolylines: function(obj, options) {
+            return this.each(addObjects('polylines', obj, options));
+        },
+        addPolygons: function(obj, options) {
+            return this.each(addObjects('polygons', obj, options));
+        },
+        addLayers: function(obj, options) {
+            return this.each(addObjects('layers', obj, options));
         },
         fitMarkers: function(zoom) {
             return this.each(fitObjects('markers', zoom));
@@ -245,36 +543,45 @@
             // If 'this' is a collection, only returns objects from first.
             return this.data('polygons');
         },
+        getLayers: function() {
+            // If 'this' is a collection, only returns objects from first.
+            return this.data('layers');
+        },
         getMap: function() {
             // If 'this' is a collection, only returns objects from first.
             return this.data('map');
         },
-        applyMap: function(obj) {
-            var objects = Array();
-            objects['mkr'] = 'markers';
-            objects['pln'] = 'polylines';
-            objects['pgn'] = 'polygons';
-
+        applyDiff: function(diff, options) {
+            return this.each(applyDiff(diff, options));
+        },
+        applyMap: function(obj, options) {
             return this.each(function() {
                 var div = $(this);
                 // Get rid of any existing objects.
-                for (var k in objects) {
-                    removeObjects(objects[k]).call(this);
+                for (var k in overlays) {
+                    removeObjects(overlays[k]).call(this);
                 }
                 // Remove any existing map.
                 div.removeData('map');
+                div.removeData('styles');
+                // Parse the shared marker images, if any.
+                if (obj.sty) {
+                    div.data('styles', parse(obj.sty));
+                }
                 // Parse the map.
                 var map = parse(obj, div.children('div')[0]);
                 // Save the map to div data.
                 div.data('map', map);
+                // Use bounds computed on the server if no center given.
+                if (obj.bds && !map.getCenter()) {
+                    fitBounds(map, parse(obj.bds), map.getZoom());
+                }
                 // Handle objects.
-                for (var k in objects) {
+                for (var k in overlays) {
                     if (k in obj) {
-                        addObjects(objects[k], obj[k]).call(this);
-                        // Auto-size map if no center or zoom given.
-                        if (!map.getCenter()) {
-                            fitObjects(objects[k], map.getZoom()).call(this);
-                        }
+                        addObjects(overlays[k], obj[k], $.extend({}, options, {
+                            complete: autoFit(overlays[k])
+                        })).call(this);
                     }
                 }
             });
@@ -286,7 +593,9 @@
                 var data = (mapdiv.attr('class').match(/{.*}/) || [])[0];
                 if (data) {
                     mapdiv.removeClass();
-                    div.applyMap($.parseJSON(data));
+                    div.applyMap($.parseJSON(data), {
+                        chunked: div.hasClass('gmap-chunked')
+                    });
                     var mapimg = div.children('img');
                     google.maps.event.addListenerOnce(div.data('map'),
                         'tilesloaded', function() {
@@ -295,10 +604,42 @@
                     );
                 }
             });
+        },
+        subscribe: function(url, options) {
+            // Apply the diffs sent as Server-Sent Events from url
+            // (see gmapi.streaming), with applyDiff options.
+            return this.each(function() {
+                var div = $(this);
+                div.unsubscribe();
+                if (!window.EventSource) {
+                    return;
+                }
+                var source = new EventSource(url);
+                source.onmessage = function(e) {
+                    div.applyDiff($.parseJSON(e.data), options);
+                };
+                div.data('eventSource', source);
+            });
+        },
+        unsubscribe: function() {
+            return this.each(function() {
+                var div = $(this);
+                var source = div.data('eventSource');
+                if (source) {
+                    source.close();
+                    div.removeData('eventSource');
+                }
+            });
+        },
+        lazyInitMap: function(margin) {
+            lazyInit(this, margin >= 0 ? margin : 200);
+            return this;
         }
     });
     $(function() {
         // Startup: Find any maps and initialize them.
-        $('div.gmap:visible').initMap();
+        $('div.gmap:visible').not('.gmap-lazy').initMap();
+        // Lazy maps are initialized when they're about to be seen.
+        $('div.gmap.gmap-lazy:visible').lazyInitMap();
     });
 })(jQuery || django.jQuery);
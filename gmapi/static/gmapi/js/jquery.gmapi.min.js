@@ -1,7 +1,70 @@
-(function(f){function p(a,b){function c(){return a.apply(this,b)}c.prototype=a.prototype;return new c}function i(a,b){b=b||window.google.maps;a=a.split(".");if(a[0]in b)return a.length>1?i(a.slice(1).join("."),b[a[0]]):b[a[0]];else throw Error(a[0]+" not found!");}function q(a,b){a.openInfoWindow=function(){a instanceof google.maps.Marker?b.open(a.getMap(),a):b.open(a)};a.closeInfoWindow=function(){b.close()};a.getInfoWindow=function(){return b};if(a instanceof google.maps.Marker)b.getMarker=function(){return a}}
-function r(a,b){for(e in b)(function(c,d,g){var j=function(){i(d,window).apply(this,arguments)};g?google.maps.event.addListenerOnce(a,c,j):google.maps.event.addListener(a,c,j)}).apply(this,b[e])}function h(a,b){if(a==="div")return b;if(f.isPlainObject(a)||f.isArray(a)){if(a.cls){var c=[];if(a.arg)for(var d in a.arg)c.push(h(a.arg[d],b));d=p(i(a.cls),c);a.nfo&&q(d,h(a.nfo,b));a.evt&&r(d,a.evt);return d}if(a.val)return i(a.val);for(c in a)a[c]=h(a[c],b)}return a}function k(a){var b=new google.maps.LatLngBounds;
-if(a instanceof google.maps.MVCArray||f.isArray(a)||f.isPlainObject(a))for(var c in a)b.union(k(a[c]));else if(a instanceof google.maps.LatLng)b.extend(a);else if(a instanceof google.maps.Marker)b.extend(a.getPosition());else if(a instanceof google.maps.Polyline)b.union(k(a.getPath()));else a instanceof google.maps.Polygon&&b.union(k(a.getPaths()));return b}function l(a){return function(){var b=f(this),c=b.data(a);for(var d in c)c[d].setMap(null);b.removeData(a)}}function m(a,b){return function(){if(b){var c=
-f(this),d=c.data("map"),g=c.data(a)||[];for(var j in b){var o=h(b[j],this);o.setMap(d);g.push(o)}c.data(a,g)}}}function n(a,b){return function(){var c=f(this),d=c.data("map");c=c.data(a);if(d&&c){c=k(c);if(b>=0){d.setZoom(b);d.setCenter(c.getCenter())}else d.fitBounds(c)}}}f.fn.extend({removeMarkers:function(){return this.each(l("markers"))},removePolylines:function(){return this.each(l("polylines"))},removePolygons:function(){return this.each(l("polygons"))},addMarkers:function(a){return this.each(m("markers",
-a))},addPolylines:function(a){return this.each(m("polylines",a))},addPolygons:function(a){return this.each(m("polygons",a))},fitMarkers:function(a){return this.each(n("markers",a))},fitPolylines:function(a){return this.each(n("polylines",a))},fitPolygons:function(a){return this.each(n("polygons",a))},getMarkers:function(){return this.data("markers")},getPolylines:function(){return this.data("polylines")},getPolygons:function(){return this.data("polygons")},getMap:function(){return this.data("map")},
-applyMap:function(a){var b=[];b.mkr="markers";b.pln="polylines";b.pgn="polygons";return this.each(function(){var c=f(this);for(var d in b)l(b[d]).call(this);c.removeData("map");var g=h(a,c.children("div")[0]);c.data("map",g);for(d in b)if(d in a){m(b[d],a[d]).call(this);g.getCenter()||n(b[d],g.getZoom()).call(this)}})},initMap:function(){return this.each(function(){var a=f(this),b=a.children("div"),c=(b.attr("class").match(/{.*}/)||[])[0];if(c){b.removeClass();a.applyMap(f.parseJSON(c));var d=a.children("img");
-google.maps.event.addListenerOnce(a.data("map"),"tilesloaded",function(){d.css("z-index",-1)})}})}});f(function(){f("div.gmap:visible").initMap()})})(jQuery||django.jQuery);
+(function(a){function o(a,c){function b(){return a.apply(this,c);}
+b.prototype=a.prototype;return new b();}
+function h(a,b){b=b||window.google.maps;a=a.split('.');if(a[0]in b){if(a.length>1){return h(a.slice(1).join('.'),b[a[0]]);}
+else{return b[a[0]];}}
+else{throw new Error(a[0]+' not found!');}}
+var p={MarkerImage:true};var j={};var c={mkr:'markers',pln:'polylines',pgn:'polygons',lyr:'layers'};function l(a){if(window.requestIdleCallback){window.requestIdleCallback(a,{timeout:100});}
+else if(window.requestAnimationFrame){window.requestAnimationFrame(a);}
+else{setTimeout(a,0);}}
+function q(a,b){a.openInfoWindow=function(){if(a instanceof google.maps.Marker){b.open(a.getMap(),a);}
+else{b.open(a);}};a.closeInfoWindow=function(){b.close();};a.getInfoWindow=function(){return b;};if(a instanceof google.maps.Marker){b.getMarker=function(){return a;};}}
+function r(a,b){for(e in b){(function(b,d,e){var c=function(){h(d,window).apply(this,arguments);};if(e){google.maps.event.addListenerOnce(a,b,c);}
+else{google.maps.event.addListener(a,b,c);}}).apply(this,b[e]);}}
+function b(c,f,d){if(c==='div'){return f;}
+if(a.isPlainObject(c)||a.isArray(c)){if(d&&typeof c.sty==='number'){return d[c.sty];}
+if(c.cls){var e=p[c.cls]&&window.JSON&&c.cls+JSON.stringify(c.arg);if(e&&e in j){return j[e];}
+var i=[];if(c.arg){for(var l in c.arg){i.push(b(c.arg[l],f,d));}}
+var g=o(h(c.cls),i);if(c.nfo){q(g,b(c.nfo,f,d));}
+if(c.evt){r(g,c.evt);}
+if(e){j[e]=g;}
+return g;}
+if(c.val){return h(c.val);}
+for(var k in c){c[k]=b(c[k],f,d);}}
+return c;}
+function m(f){var g=[];var c=[0,0];var a=0,d=0,b=0;for(var e=0;e<f.length;e++){var h=f.charCodeAt(e)-63;a|=(h&0x1f)<<d;d+=5;if(h<0x20){c[b]+=a&1?~(a>>1):a>>1;a=d=0;b=1-b;if(!b){g.push(new google.maps.LatLng(c[0]/1e5,c[1]/1e5));}}}
+return g;}
+function s(b,d,e){var c=[];var f=-1;var g=function(){var h=e.getZoom();var g=0;while(g+1<d.length&&d[g+1][0]<=h){g++;}
+if(g===f){return;}
+f=g;if(!c[g]){if(b instanceof google.maps.Polygon){c[g]=a.map(d[g][1],function(a){return[m(a)];});}
+else{c[g]=m(d[g][1]);}}
+if(b instanceof google.maps.Polygon){b.setPaths(c[g]);}
+else{b.setPath(c[g]);}};g();b.gmapiLevels=google.maps.event.addListener(e,'zoom_changed',g);}
+function n(a){if(a.gmapiLevels){google.maps.event.removeListener(a.gmapiLevels);delete a.gmapiLevels;}}
+function f(b){var c=new google.maps.LatLngBounds();if(b instanceof google.maps.MVCArray||a.isArray(b)||a.isPlainObject(b)){for(var d in b){c.union(f(b[d]));}}
+else if(b instanceof google.maps.LatLng){c.extend(b);}
+else if(b instanceof google.maps.Marker){c.extend(b.getPosition());}
+else if(b instanceof google.maps.Polyline){c.union(f(b.getPath()));}
+else if(b instanceof google.maps.Polygon){c.union(f(b.getPaths()));}
+else if(google.maps.visualization&&b instanceof google.maps.visualization.HeatmapLayer){c.union(f(b.getData()));}
+return c;}
+function g(b){return function(){var c=a(this);var d=c.data(b);for(var e in d){d[e].setMap(null);n(d[e]);}
+c.removeData(b);c.removeData(b+'ById');};}
+function d(c,d,e){e=e||{};return function(){if(d){var i=this;var f=a(this);var j=f.data('map');var h=f.data(c)||[];var k=f.data(c+'ById')||{};f.data(c,h);f.data(c+'ById',k);var g=0;var m=function(){var a=d[g++];var c=b(a,i,f.data('styles'));c.setMap(j);if(a.lod&&a.lod.length){s(c,a.lod,j);}
+h.push(c);if(a.oid!=null){c.gmapiId=a.oid;k[a.oid]=c;}};var n=function(){f.trigger('gmapi-complete',[c]);if(e.complete){e.complete.call(i);}};if(!e.chunked){while(g<d.length){m();}
+n();return;}
+var o=function(){if(f.data(c)!==h){return;}
+var a=new Date().getTime()+(e.chunkTime||10);while(g<d.length&&new Date().getTime()<a){m();}
+f.trigger('gmapi-progress',[c,g,d.length]);if(g<d.length){l(o);}
+else{n();}};l(o);}};}
+function k(a,b,c){if(c>=0){a.setZoom(c);a.setCenter(b.getCenter());}
+else{a.fitBounds(b);}}
+function i(b,c){return function(){var d=a(this);var e=d.data('map');var g=d.data(b);if(e&&g){k(e,f(g),c);}};}
+function t(f,c){if(window.IntersectionObserver){var g=new IntersectionObserver(function(b){a.each(b,function(){if(this.isIntersecting){g.unobserve(this.target);a(this.target).initMap();}});},{rootMargin:c+'px'});f.each(function(){g.observe(this);});}
+else{var b=a(window);var d=f;var e=null;var h=function(){e=null;var f=b.scrollTop()-c;var g=b.scrollTop()+b.height()+c;d=d.filter(function(){var b=a(this);var c=b.offset().top;if(c<g&&c+b.height()>f){b.initMap();return false;}
+return true;});if(!d.length){b.unbind('scroll resize',i);}};var i=function(){if(!e){e=setTimeout(h,100);}};b.bind('scroll resize',i);h();}}
+function u(c,b){return function(){var i=a(this);var d=i.data(c)||[];var j=i.data(c+'ById')||{};var g={};for(var h in b){var f=j[b[h]];if(f){f.setMap(null);n(f);delete j[b[h]];g[b[h]]=f;}}
+var k=0;for(var e=0;e<d.length;e++){var l=d[e].gmapiId;if(!(l in g&&g[l]===d[e])){d[k++]=d[e];}}
+d.length=k;};}
+function v(e,f){return function(){var j=a(this);var h=j.data('map');if(!h||!e){return;}
+if(e.opt){h.setOptions(b(e.opt,this));}
+if(e.bds){k(h,b(e.bds),h.getZoom());}
+for(var i in c){var g=e[i];if(!g){continue;}
+if(g.rm){u(c[i],g.rm).call(this);}
+var m=j.data(c[i]+'ById')||{};for(var l in g.chg){if(m[l]){m[l].setOptions(b(g.chg[l],this,j.data('styles')));}}
+if(g.add){d(c[i],g.add,f).call(this);}}};}
+function w(b){return function(){var c=a(this).data('map');if(!c.getCenter()){i(b,c.getZoom()).call(this);}};}
+a.fn.extend({removeMarkers:function(){return this.each(g('markers'));},removePolylines:function(){return this.each(g('polylines'));},removePolygons:function(){return this.each(g('polygons'));},removeLayers:function(){return this.each(g('layers'));},addMarkers:function(a,b){return this.each(d('markers',a,b));},addPolylines:function(a,b){return this.each(d('polylines',a,b));},addPolygons:function(a,b){return this.each(d('polygons',a,b));},addLayers:function(a,b){return this.each(d('layers',a,b));},fitMarkers:function(a){return this.each(i('markers',a));},fitPolylines:function(a){return this.each(i('polylines',a));},fitPolygons:function(a){return this.each(i('polygons',a));},getMarkers:function(){return this.data('markers');},getPolylines:function(){return this.data('polylines');},getPolygons:function(){return this.data('polygons');},getLayers:function(){return this.data('layers');},getMap:function(){return this.data('map');},applyDiff:function(a,b){return this.each(v(a,b));},applyMap:function(e,f){return this.each(function(){var i=a(this);for(var h in c){g(c[h]).call(this);}
+i.removeData('map');i.removeData('styles');if(e.sty){i.data('styles',b(e.sty));}
+var j=b(e,i.children('div')[0]);i.data('map',j);if(e.bds&&!j.getCenter()){k(j,b(e.bds),j.getZoom());}
+for(var h in c){if(h in e){d(c[h],e[h],a.extend({},f,{complete:w(c[h])})).call(this);}}});},initMap:function(){return this.each(function(){var b=a(this);var c=b.children('div');var d=(c.attr('class').match(/{.*}/)||[])[0];if(d){c.removeClass();b.applyMap(a.parseJSON(d),{chunked:b.hasClass('gmap-chunked')});var e=b.children('img');google.maps.event.addListenerOnce(b.data('map'),'tilesloaded',function(){e.css('z-index',-1);});}});},subscribe:function(b,c){return this.each(function(){var d=a(this);d.unsubscribe();if(!window.EventSource){return;}
+var e=new EventSource(b);e.onmessage=function(b){d.applyDiff(a.parseJSON(b.data),c);};d.data('eventSource',e);});},unsubscribe:function(){return this.each(function(){var b=a(this);var c=b.data('eventSource');if(c){c.close();b.removeData('eventSource');}});},lazyInitMap:function(a){t(this,a>=0?a:200);return this;}});a(function(){a('div.gmap:visible').not('.gmap-lazy').initMap();a('div.gmap.gmap-lazy:visible').lazyInitMap();});})(jQuery||django.jQuery);
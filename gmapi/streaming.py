@@ -0,0 +1,121 @@
+"""Live overlay updates over Server-Sent Events.
+
+A view hands a source of changes to response() and the jQuery
+plugin's subscribe applies them to the markers already on the map:
+
+    def positions(request):
+        return streaming.response(vehicle_changes())
+
+    $('#id_map').subscribe('/positions/');
+
+The source yields changes made with moved, added, changed and removed.
+Each event is a diff (see gmapi.diffs) holding the changes from one
+time window, in which repeated moves of a marker are reduced to the
+last one. A source that waits for changes should yield None every now
+and then, so that windows can be closed and keep-alive comments sent
+while nothing happens.
+
+"""
+import time
+from django.http import StreamingHttpResponse
+from gmapi import maps
+
+
+_keys = {maps.Marker: 'mkr', maps.Polyline: 'pln', maps.Polygon: 'pgn'}
+
+
+def moved(id, position):
+    """A marker moved to position (a LatLng or a (lat, lng) pair)."""
+    if not isinstance(position, maps.LatLng):
+        position = maps.LatLng(*position)
+    return ('chg', 'mkr', id, {'position': position})
+
+
+def changed(id, opts, key='mkr'):
+    """Options of an overlay changed."""
+    return ('chg', key, id, opts)
+
+
+def added(overlay):
+    """An overlay (with an id) was added."""
+    return ('add', _keys[type(overlay)], overlay.getId(), overlay)
+
+
+def removed(id, key='mkr'):
+    """An overlay was removed."""
+    return ('rm', key, id, None)
+
+
+class _Batch(object):
+    """The changes of one window, as a diff."""
+    def __init__(self):
+        self.diff = {}
+        self.added = set()
+
+    def merge(self, change):
+        """Add a change, unless it touches an overlay added in this batch.
+
+        applyDiff removes, changes and then adds, so such a change has to
+        wait for the next batch.
+
+        """
+        op, key, id, value = change
+        if (key, id) in self.added:
+            return False
+        part = self.diff.setdefault(key, {})
+        if op == 'chg':
+            part.setdefault('chg', {}).setdefault(id, {}).update(value)
+        elif op == 'add':
+            part.setdefault('add', []).append(value)
+            self.added.add((key, id))
+        else:
+            part.get('chg', {}).pop(id, None)
+            part.setdefault('rm', []).append(id)
+        return True
+
+
+def events(changes, window=0.5, heartbeat=15, retry=None, clock=time.time):
+    """Turn a source of changes into Server-Sent Events.
+
+    Changes within window seconds of the first pending one are sent as
+    one event. A keep-alive comment is sent after heartbeat seconds
+    without events. With retry, clients reconnect after that many
+    milliseconds.
+
+    """
+    if retry is not None:
+        yield 'retry: %d\n\n' % retry
+    batch, start = _Batch(), None
+    last = clock()
+    for change in changes:
+        now = clock()
+        if start is not None and now - start >= window:
+            yield 'data: %s\n\n' % maps.dumps(batch.diff)
+            batch, start, last = _Batch(), None, now
+        if change is None:
+            if start is None and now - last >= heartbeat:
+                yield ': keep-alive\n\n'
+                last = now
+            continue
+        if not batch.merge(change):
+            yield 'data: %s\n\n' % maps.dumps(batch.diff)
+            batch, start, last = _Batch(), None, now
+            batch.merge(change)
+        if start is None:
+            start = now
+    if start is not None:
+        yield 'data: %s\n\n' % maps.dumps(batch.diff)
+
+
+def response(changes, **kwargs):
+    """Return a streaming text/event-stream response for changes.
+
+    Takes the same keyword arguments as events.
+
+    """
+    result = StreamingHttpResponse(events(changes, **kwargs),
+                                   content_type='text/event-stream')
+    result['Cache-Control'] = 'no-cache'
+    # Keep proxies such as nginx from buffering the events.
+    result['X-Accel-Buffering'] = 'no'
+    return result
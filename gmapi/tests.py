@@ -43,5 +43,537 @@
 >>> m
 {'arg': ['div', {'mapTypeId': {'val': 'MapTypeId.SATELLITE'}, 'center': {'arg': [0, 0], 'cls': 'LatLng'}, 'zoom': 4}], 'mkr': [{'arg': [{'position': {'arg': [38, -97], 'cls': 'LatLng'}}], 'cls': 'Marker'}], 'cls': 'Map'}
 
+# Test geocoding from a local gazetteer.
+>>> from gmapi import geocoders
+>>> gazetteer = geocoders.GazetteerBackend([
+...     {'address': 'Alexanderplatz, Berlin', 'lat': '52.5219', 'lng': '13.4132'},
+...     {'address': 'Alexanderstrasse, Berlin', 'lat': '52.5197', 'lng': '13.4186',
+...      'south': '52.5180', 'west': '13.4160', 'north': '52.5210', 'east': '13.4210'},
+... ])
+>>> g = maps.Geocoder(gazetteer)
+>>> results, status = g.geocode({'address': u'  ALEXANDERPLATZ,  Berlin'})
+>>> status
+'OK'
+>>> results[0]['geometry']['location']
+{'arg': [52.5219, 13.4132], 'cls': 'LatLng'}
 
+# Test prefix matches and bounds conversion.
+>>> results, status = g.geocode({'address': 'alexanderstr'})
+>>> [r['formatted_address'] for r in results]
+[u'Alexanderstrasse, Berlin']
+>>> results[0]['geometry']['viewport']
+{'arg': [{'arg': [52.518, 13.416], 'cls': 'LatLng'}, {'arg': [52.521, 13.421], 'cls': 'LatLng'}], 'cls': 'LatLngBounds'}
+>>> g.geocode({'address': 'potsdamer platz'})
+(None, 'ZERO_RESULTS')
+
+# Test falling back to another backend.
+>>> class Upstream(geocoders.BaseBackend):
+...     def geocode(self, request):
+...         return {'status': 'OK', 'results': [{'geometry': {'location': {'lat': 52.5096, 'lng': 13.3759}}}]}
+>>> g = maps.Geocoder(geocoders.ChainBackend([gazetteer, Upstream()]))
+>>> g.geocode({'address': 'potsdamer platz'})[0][0]['geometry']['location']
+{'arg': [52.5096, 13.3759], 'cls': 'LatLng'}
+
+# Test loading the gazetteer from CSV and SQLite files.
+>>> import os, sqlite3, tempfile
+>>> folder = tempfile.mkdtemp()
+>>> path = os.path.join(folder, 'places.csv')
+>>> with open(path, 'wb') as f:
+...     f.write('address,lat,lng,south,west,north,east\\n'
+...             'Alexanderplatz,52.5219,13.4132\\n'
+...             'Alexanderstrasse,52.5197,13.4186,52.518,13.416,52.521,13.421\\n')
+>>> g = maps.Geocoder(geocoders.GazetteerBackend(path))
+>>> [('viewport' in r['geometry']) for r in g.geocode({'address': 'alexander'})[0]]
+[False, True]
+>>> path = os.path.join(folder, 'places.db')
+>>> db = sqlite3.connect(path)
+>>> db.execute('CREATE TABLE gazetteer (address, lat, lng, south, west, north, east)') and None
+>>> db.execute("INSERT INTO gazetteer VALUES ('Alexanderplatz', 52.5219, 13.4132, NULL, NULL, NULL, NULL)") and None
+>>> db.commit(); db.close()
+>>> g = maps.Geocoder(geocoders.GazetteerBackend(path))
+>>> g.geocode({'address': 'alexanderplatz'})[0][0]['geometry']['location']
+{'arg': [52.5219, 13.4132], 'cls': 'LatLng'}
+>>> import shutil; shutil.rmtree(folder)
+
+# Test extending and querying bounds.
+>>> b = maps.LatLngBounds()
+>>> b.isEmpty()
+True
+>>> b.extend(maps.LatLng(52.52, 13.4)).extend(maps.LatLng(48.85, 2.35))
+{'arg': [{'arg': [48.85, 2.35], 'cls': 'LatLng'}, {'arg': [52.52, 13.4], 'cls': 'LatLng'}], 'cls': 'LatLngBounds'}
+>>> b.getCenter()
+{'arg': [50.685, 7.875], 'cls': 'LatLng'}
+>>> b.contains(maps.LatLng(50, 8)), b.contains(maps.LatLng(50, 20))
+(True, False)
+>>> b.intersects(maps.LatLngBounds(maps.LatLng(40, 0), maps.LatLng(50, 5)))
+True
+>>> b.union(maps.LatLngBounds(maps.LatLng(40, 0), maps.LatLng(50, 5)))
+{'arg': [{'arg': [40, 0], 'cls': 'LatLng'}, {'arg': [52.52, 13.4], 'cls': 'LatLng'}], 'cls': 'LatLngBounds'}
+
+# Test bounds crossing the antimeridian.
+>>> b = maps.LatLngBounds(maps.LatLng(0, 170), maps.LatLng(10, 175))
+>>> b.extend(maps.LatLng(5, -175)).getNorthEast()
+{'arg': [10, -175], 'cls': 'LatLng'}
+>>> b.contains(maps.LatLng(5, 179)), b.getCenter()
+(True, {'arg': [5, 177.5], 'cls': 'LatLng'})
+>>> b = maps.LatLngBounds(maps.LatLng(0, 0), maps.LatLng(10, 10))
+>>> unicode(b.union(maps.LatLngBounds(maps.LatLng(0, -170), maps.LatLng(10, 170))))
+u'0,-170,10,170'
+>>> b.contains(maps.LatLng(5, 100))
+True
+>>> b = maps.LatLngBounds(maps.LatLng(0, 170), maps.LatLng(10, 175))
+>>> unicode(b.union(maps.LatLngBounds(maps.LatLng(0, -175), maps.LatLng(10, -170))))
+u'0,170,10,-170'
+>>> unicode(b.union(maps.LatLngBounds(maps.LatLng(0, -10), maps.LatLng(10, 175))))
+u'0,-10,10,-170'
+>>> b.toSpan()
+{'arg': [10, 200], 'cls': 'LatLng'}
+>>> unicode(b.union(maps.LatLngBounds(maps.LatLng(0, -175), maps.LatLng(10, 175))))
+u'0,-180,10,180'
+>>> maps.LatLngBounds().getCenter(), maps.LatLngBounds().toSpan()
+({'arg': [0, 0], 'cls': 'LatLng'}, {'arg': [0, 0], 'cls': 'LatLng'})
+
+# Test spherical geometry.
+>>> from gmapi.geometry import spherical, poly, computeBounds
+>>> berlin, paris = maps.LatLng(52.52, 13.4), maps.LatLng(48.85, 2.35)
+>>> round(spherical.computeDistanceBetween(berlin, paris))
+878660.0
+>>> round(spherical.computeHeading(berlin, paris), 2)
+-113.3
+>>> spherical.interpolate(berlin, paris, 0.5)
+{'arg': [50.815521, 7.658182], 'cls': 'LatLng'}
+>>> spherical.computeOffset(berlin, 10000, 90)
+{'arg': [52.519908, 13.547631], 'cls': 'LatLng'}
+>>> square = [(0, 0), (0, 1), (1, 1), (1, 0)]
+>>> round(spherical.computeArea(square) / 1e6)
+12392.0
+>>> poly.containsLocation((0.5, 0.5), square), poly.containsLocation((1.5, 0.5), square)
+(True, False)
+>>> poly.isLocationOnEdge((0, 0.5), square)
+True
+
+# Test batch variants.
+>>> [round(d) for d in spherical.computeDistanceBetweenBatch([berlin, paris], [paris, (48.86, 2.35)])]
+[878660.0, 1113.0]
+>>> [bool(c) for c in poly.containsLocationBatch([(0.5, 0.5), (1.5, 0.5)], square)]
+[True, False]
+
+# Test precomputing the bounds a map is fitted to.
+>>> m = maps.Map()
+>>> k = maps.Marker({'map': m, 'position': berlin})
+>>> p = maps.Polyline({'map': m, 'path': [paris, maps.LatLng(40.42, -3.7)]})
+>>> m.fitBounds(computeBounds(m))
+>>> m['bds']
+{'arg': [{'arg': [40.42, -3.7], 'cls': 'LatLng'}, {'arg': [52.52, 13.4], 'cls': 'LatLng'}], 'cls': 'LatLngBounds'}
+>>> unicode(computeBounds([[1, 2], (3, 4), [maps.LatLng(-1, 5)]]))
+u'-1,2,3,5'
+
+# Test restoring a serialized map.
+>>> m = maps.Map({'center': maps.LatLng(38, -97), 'mapTypeId': maps.MapTypeId.ROADMAP})
+>>> k = maps.Marker({'map': m, 'position': maps.LatLng(38, -97), 'color': 'blue', 'label': 'A'})
+>>> l = maps.event.addListener(k, 'click', 'myobj.markerClick')
+>>> maps.InfoWindow({'content': 'Hello!'}).open(m, k)
+>>> r = maps.Map.from_json(maps.dumps(m))
+>>> r == m, unicode(r) == unicode(m)
+(True, True)
+>>> r.getMapTypeId() is maps.MapTypeId.ROADMAP
+True
+>>> r.markers[0].getMap() is r, r.markers[0]['evt'][0].instance is r.markers[0]
+(True, True)
+>>> r.markers[0]['nfo'].getContent()
+u'Hello!'
+
+# Test the binary format.
+>>> r = maps.loads(maps.dumps(m, binary=True))
+>>> r == m, unicode(r) == unicode(m), r.markers[0].getMap() is r
+(True, True, True)
+>>> import gc
+>>> maps.loads(maps.dumps(m, binary=True), pause_gc=True) == m, gc.isenabled()
+(True, True)
+>>> maps.Map.from_json(maps.dumps(k))
+Traceback (most recent call last):
+    ...
+ValueError: Data is not a serialized Map.
+
+# Test incremental diffs.
+>>> from gmapi import diffs
+>>> m = maps.Map({'zoom': 3})
+>>> a = maps.Marker({'map': m, 'position': maps.LatLng(1, 1), 'title': 'A'})
+>>> a.setId(1)
+>>> b = maps.Marker({'map': m, 'position': maps.LatLng(2, 2)})
+>>> b.setId(2)
+>>> c = maps.Marker({'map': m, 'position': maps.LatLng(3, 3)})
+>>> snap = diffs.snapshot(m)
+>>> c.getId()
+'2733f04af005'
+>>> diffs.diff(snap, m)
+{}
+>>> m.setZoom(4)
+>>> a.setPosition(maps.LatLng(5, 5))
+>>> b.setMap(None)
+>>> d = maps.Marker({'map': m, 'position': maps.LatLng(4, 4)})
+>>> d.setId('d')
+>>> maps.dumps(diffs.diff(snap, m))
+'{"opt":{"zoom":4},"mkr":{"rm":[2],"add":[{"arg":[{"position":{"arg":[4.0,4.0],"cls":"LatLng"}}],"oid":"d","cls":"Marker"}],"chg":{"1":{"position":{"arg":[5.0,5.0],"cls":"LatLng"}}}}}'
+
+# Anything but options replaces the overlay.
+>>> l = maps.event.addListener(c, 'click', 'myobj.markerClick')
+>>> diffs.diff(snap, m)['mkr']['rm']
+[2, '2733f04af005']
+
+# The order in which options were set doesn't matter.
+>>> m = maps.Map({'zoom': 3})
+>>> e = maps.Marker({'map': m, 'position': maps.LatLng(6, 6)})
+>>> e.setTitle('E'); e.setClickable(False); e.setZIndex(2)
+>>> e.setDraggable(True); e.setVisible(True)
+>>> f = maps.Marker({'visible': True, 'draggable': True, 'zIndex': 2,
+...                  'clickable': False, 'title': 'E',
+...                  'position': maps.LatLng(6, 6)})
+>>> e['arg'][0].keys() == f['arg'][0].keys()
+False
+>>> snap = diffs.snapshot(m)
+>>> e.setMap(None)
+>>> f.setMap(m)
+>>> diffs.diff(snap, m)
+{}
+>>> f.setId(7)
+>>> snap = diffs.snapshot(m)
+>>> f.setMap(None)
+>>> e.setId(7)
+>>> e.setMap(m)
+>>> diffs.diff(snap, m)
+{}
+
+# Test streaming changes, with a fake clock.
+>>> from gmapi import streaming
+>>> now = [0]
+>>> def vehicles():
+...     for i in xrange(5):
+...         now[0] += .1
+...         yield streaming.moved(1, (i, i))
+...     now[0] += .1
+...     k = maps.Marker({'position': maps.LatLng(3, 3)})
+...     k.setId(3)
+...     yield streaming.added(k)
+...     yield streaming.moved(3, (4, 4))
+...     yield streaming.removed(1)
+...     now[0] += 20
+...     yield None
+...     now[0] += 20
+...     yield None
+>>> for e in streaming.events(vehicles(), clock=lambda: now[0]):
+...     print e,
+data: {"mkr":{"chg":{"1":{"position":{"arg":[4.0,4.0],"cls":"LatLng"}}}}}
+<BLANKLINE>
+data: {"mkr":{"add":[{"arg":[{"position":{"arg":[3.0,3.0],"cls":"LatLng"}}],"oid":3,"cls":"Marker"}]}}
+<BLANKLINE>
+data: {"mkr":{"rm":[1],"chg":{"3":{"position":{"arg":[4.0,4.0],"cls":"LatLng"}}}}}
+<BLANKLINE>
+: keep-alive
+<BLANKLINE>
+>>> r = streaming.response(iter([streaming.removed(2)]))
+>>> r['Content-Type'], ''.join(r.streaming_content)
+('text/event-stream', 'data: {"mkr":{"rm":[2]}}\\n\\n')
+>>> from django.test import Client
+>>> from django.test.utils import override_settings
+>>> with override_settings(ROOT_URLCONF='gmapi.tests'):
+...     r = Client().get('/events/')
+>>> r.status_code, r.streaming, r['Content-Type'], r['Cache-Control'], r['X-Accel-Buffering']
+(200, True, 'text/event-stream', 'no-cache', 'no')
+>>> ''.join(r.streaming_content)
+'retry: 2000\\n\\ndata: {"mkr":{"rm":[2],"chg":{"1":{"position":{"arg":[2.0,2.0],"cls":"LatLng"}}}}}\\n\\n'
+
+# Test rate limiting, with a fake clock.
+>>> from gmapi.utils.ratelimit import QuotaExceeded, RateLimiter
+>>> now, waited = [86400 * 100.0], []
+>>> limiter = RateLimiter(qps=2, daily=5, clock=lambda: now[0], sleep=lambda s: (waited.append(s), now.__setitem__(0, now[0] + s)))
+>>> for i in xrange(4):
+...     limiter.acquire()
+>>> waited, limiter.remaining()
+([0.5, 0.5, 0.5, 0.5], 1)
+>>> limiter.acquire()
+>>> limiter.acquire()
+Traceback (most recent call last):
+    ...
+QuotaExceeded: The daily quota of 5 requests has been used up.
+>>> now[0] += 86400
+>>> limiter.remaining()
+5
+>>> limiter.pause(60)
+>>> limiter.remaining()
+0
+>>> for i in xrange(1000):
+...     limiter.store.set(i, 1, -1)
+>>> now[0] += 1
+>>> limiter.store.set('x', 1, 1)
+>>> sorted(limiter.store._data)
+['gmapi.ratelimit:day:100', 'gmapi.ratelimit:pause', 'x']
+
+
+# Test that concurrent identical lookups share one query.
+>>> import threading
+>>> from gmapi.geocoders import GoogleBackend
+>>> server, hits = _stub_server()
+>>> geocoder = maps.Geocoder(GoogleBackend('http://127.0.0.1:%d' % server.server_port))
+>>> results = []
+>>> threads = [threading.Thread(target=lambda: results.append(geocoder.geocode({'address': 'Stampede Street 1'}))) for _ in xrange(20)]
+>>> for t in threads:
+...     t.start()
+>>> for t in threads:
+...     t.join()
+>>> len(hits), len(results), results[0][1], results[0] == results[-1]
+(1, 20, u'OK', True)
+>>> server.shutdown()
+
+# Retries wait between attempts, but not after the last one.
+>>> server, hits = _stub_server('OVER_QUERY_LIMIT', delay=0)
+>>> now, slept = [0], []
+>>> limiter = RateLimiter(qps=100, daily=100, clock=lambda: now[0], sleep=lambda s: None)
+>>> backend = GoogleBackend('http://127.0.0.1:%d' % server.server_port, limiter)
+>>> sleep, time.sleep = time.sleep, slept.append
+>>> try:
+...     backend.geocode({'address': 'Busy Street 1'})
+... finally:
+...     time.sleep = sleep
+Traceback (most recent call last):
+    ...
+QuotaExceeded: Geocoding has failed too many times. You might have exceeded your daily limit.
+>>> len(hits), slept, limiter.remaining()
+(3, [0.5, 1.0], 0)
+>>> server.shutdown()
+
+# Test waiting for another process that holds the cache lock.
+>>> from django.core.cache import cache
+>>> from gmapi.utils.singleflight import CachedCall
+>>> now = [0]
+>>> def sleep(s):
+...     now[0] += s
+...     if now[0] >= .2:
+...         cache.set('answer', (42, 60), 60)
+>>> calls = CachedCall(lock_timeout=5, clock=lambda: now[0], sleep=sleep)
+>>> cache.add('answer:lock', True, 5)
+True
+>>> calls.get('answer', lambda: 0), now[0] >= .2
+(42, True)
+
+# Test serving a stale value while refreshing it.
+>>> spawned = []
+>>> calls = CachedCall(timeout=10, stale=60, lock_timeout=5, clock=lambda: now[0], spawn=lambda *a: spawned.append(a))
+>>> calls.get('stale', lambda: 'old')
+'old'
+>>> now[0] += 30
+>>> calls.get('stale', lambda: 'new'), calls.get('stale', lambda: 'newer'), len(spawned)
+('old', 'old', 1)
+>>> refresh = spawned.pop()
+>>> refresh[0](*refresh[1:])
+>>> calls.get('stale', lambda: 'newer'), cache.get('stale:lock')
+('new', None)
+
+# Test keeping the stale value when refreshing it fails.
+>>> def paused():
+...     raise QuotaExceeded('Requests are paused.')
+>>> now[0] += 30
+>>> calls.get('stale', paused)
+'new'
+>>> refresh = spawned.pop()
+>>> refresh[0](*refresh[1:])
+>>> cache.get('stale:lock'), calls.get('stale', paused)
+(None, 'new')
+
+# Test refreshing values before they expire.
+>>> calls = CachedCall(timeout=10, ahead=3, clock=lambda: now[0], spawn=lambda fn, *args: fn(*args))
+>>> calls.get('ahead', lambda: 1)
+1
+>>> now[0] += 8
+>>> calls.get('ahead', lambda: 2), calls.get('ahead', lambda: 3)
+(1, 2)
+
+# Test that stale reads start one refresh, which skips fresh values.
+>>> spawned = []
+>>> calls = CachedCall(timeout=10, stale=60, clock=lambda: now[0], spawn=lambda *a: spawned.append(a))
+>>> calls.get('once', lambda: 1)
+1
+>>> now[0] += 30
+>>> [calls.get('once', lambda: 2) for _ in xrange(5)], len(spawned)
+([1, 1, 1, 1, 1], 1)
+>>> calls.set('once', 3)
+>>> refresh = spawned.pop()
+>>> refresh[0](*refresh[1:])
+>>> calls.get('once', lambda: 4), spawned
+(3, [])
+
+# Test sharing marker images and writing them to a style table.
+>>> m = maps.Map()
+>>> a = maps.Marker({'map': m, 'position': maps.LatLng(1, 1), 'color': 'red'})
+>>> b = maps.Marker({'map': m, 'position': maps.LatLng(2, 2), 'color': 'red'})
+>>> a.getIcon() is b.getIcon(), a.getShadow() is b.getShadow()
+(True, True)
+>>> maps.MarkerImage.shared('http://x/a.png') is maps.MarkerImage.shared('http://x/a.png')
+True
+>>> s = maps.dumps(m, styles=True)
+>>> s.count('MarkerImage'), s.count('{"sty":0}'), s.count('{"sty":1}')
+(2, 2, 2)
+>>> r = maps.loads(s)
+>>> r == m, 'sty' in r, r.markers[0].getIcon() is r.markers[1].getIcon()
+(True, False, True)
+
+# Test encoded paths and levels of detail.
+>>> from gmapi.geometry import encoding, levelsOfDetail
+>>> encoding.encodePath([(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)])
+'_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+>>> [unicode(p) for p in encoding.decodePath('_p~iF~ps|U_ulLnnqC_mqNvxq`@')]
+[u'38.5,-120.2', u'40.7,-120.95', u'43.252,-126.453']
+>>> route = [maps.LatLng(0, 0), maps.LatLng(0.5, 0.001), maps.LatLng(1, 0), maps.LatLng(1, 3)]
+>>> [len(path) for path in levelsOfDetail(route, zooms=(0, 10, 15))]
+[3, 4, 4]
+>>> m = maps.Map()
+>>> p = maps.Polyline({'map': m, 'path': route})
+>>> p.setLevelsOfDetail(zooms=(0, 10))
+>>> p['lod'], 'path' in p['arg'][0], len(p.getPath())
+([[0, '??_ibE??_}hQ'], [10, '??_t`BgE_t`BfE?_}hQ']], False, 4)
+>>> unicode(maps.loads(maps.dumps(m)).polylines[0].getPath()[1])
+u'0.5,0.001'
+>>> route[1] = maps.LatLng(52.123456, 13.123456)
+>>> p.setPath(route)
+>>> p.setLevelsOfDetail()
+>>> unicode(maps.loads(maps.dumps(m)).polylines[0].getPath()[1])
+u'52.12346,13.12346'
+>>> r = maps.loads(maps.dumps(m, binary=True))
+>>> unicode(r) == unicode(m), r == m, unicode(r.polylines[0].getPath()[1])
+(True, True, u'52.123456,13.123456')
+>>> p.setPath(route[:2])
+>>> 'lod' in p, len(p.getPath())
+(False, 2)
+>>> g = maps.Polygon({'map': m})
+>>> g.setLevelsOfDetail()
+>>> 'lod' in g, maps.loads(maps.dumps(m)) == m
+(False, True)
+
+# Test heatmap layers.
+>>> m = maps.Map()
+>>> h = maps.HeatmapLayer({'map': m, 'radius': 20,
+...     'data': [{'location': maps.LatLng(1, 2), 'weight': 3}]})
+>>> m.layers == [h], h.getMap() is m
+(True, True)
+>>> maps.dumps(h)
+'{"arg":[{"data":[{"location":{"arg":[1.0,2.0],"cls":"LatLng"},"weight":3}],"radius":20}],"cls":"visualization.HeatmapLayer"}'
+>>> r = maps.loads(maps.dumps(m))
+>>> r == m, r.layers[0].getMap() is r
+(True, True)
+>>> h.setMap(None)
+>>> m.layers
+[]
+
+
+"""
+
+
+import BaseHTTPServer
+import doctest
+import threading
+import time
+import unittest
+from django.conf.urls import url
+from gmapi import maps, streaming
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _stub_server(status='OK', delay=.2):
+    """Start a slow fake geocoding service and return it with its hits."""
+    hits = []
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            hits.append(self.path)
+            if delay:
+                time.sleep(delay)
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write('{"status": "%s", "results": [{"geometry": '
+                             '{"location": {"lat": 1, "lng": 2}}}]}' % status)
+
+        def log_message(self, *args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, hits
+
+
+def _vehicle_events(request):
+    """Stream changes from a stub event source."""
+    return streaming.response(iter([streaming.moved(1, (1, 1)),
+                                    streaming.moved(1, (2, 2)),
+                                    streaming.removed(2)]),
+                              window=60, retry=2000)
+
+
+urlpatterns = [
+    url(r'^events/$', _vehicle_events),
+]
+
+
+# DensityGrid needs NumPy, so these aren't part of the module doctests.
+_DENSITY_TESTS = """
+>>> from gmapi.aggregation import DensityGrid
+>>> from gmapi.geometry import poly
+>>> points = numpy.random.RandomState(0).normal((52.5, 13.4), 2, (5000, 2))
+>>> grids = dict((shape, DensityGrid(shape=shape, size=32)) for shape in ('square', 'hex'))
+>>> for grid in grids.values():
+...     for i in xrange(0, 5000, 1200):
+...         grid.add(points[i:i + 1200])
+>>> [(shape, grid.count, sorted(set(grid.cells(z)[2].sum() for z in grid.zooms)))
+...  for shape, grid in sorted(grids.items())]
+[('hex', 5000, [5000.0]), ('square', 5000, [5000.0])]
+
+# Test that square cells computed down the pyramid match binning each zoom.
+>>> def binned(zoom, shape='square', rows=points):
+...     grid = DensityGrid([zoom], size=32, shape=shape)
+...     grid.add(rows)
+...     return grid
+>>> all(numpy.allclose(a, b) for z in (0, 7, 10)
+...     for a, b in zip(grids['square'].cells(z), binned(z).cells(z)))
+True
+
+# Test that points lie inside their own hexagon.
+>>> all(poly.containsLocation(maps.LatLng(lat, lng), binned(10, 'hex', [(lat, lng)]).polygons(10)[0])
+...     for lat, lng in points[:300].tolist())
+True
+>>> [len(p.getPaths()[0]) for p in binned(3, 'hex', points[:1]).polygons(3)]
+[6]
+
+# Test reading weighted rows in chunks, skipping missing coordinates.
+>>> grid = DensityGrid(size=32)
+>>> grid.update(iter(points.tolist()), chunk=700)
+>>> all(numpy.allclose(a, b) for z in grid.zooms
+...     for a, b in zip(grid.cells(z), grids['square'].cells(z)))
+True
+>>> grid = DensityGrid([4], size=64)
+>>> grid.update([(52.5, 13.4, 2), (52.6, 13.5, 1.5), (float('nan'), 0, 9), (-33.9, 151.2, 1)], chunk=2)
+>>> [('%.1f,%.1f' % (p['location'].lat(), p['location'].lng()), p['weight'])
+...  for p in grid.weightedPoints(4)]
+[('54.2,14.1', 3.5), ('-34.3,149.1', 1)]
+
+# Test grading cells into fill colors by density.
+>>> grid = DensityGrid([5], size=64)
+>>> grid.add([(0, 0)] * 100 + [(20, 20)] * 10 + [(40, 40)])
+>>> [p['arg'][0]['fillColor'] for p in grid.polygons(5)]
+['#ffffb2', '#fd8d3c', '#bd0026']
 """
+
+
+class DensityGridTest(unittest.TestCase):
+    @unittest.skipIf(numpy is None, 'DensityGrid needs NumPy.')
+    def test_doctests(self):
+        test = doctest.DocTestParser().get_doctest(
+            _DENSITY_TESTS, {'maps': maps, 'numpy': numpy},
+            'gmapi.tests._DENSITY_TESTS', __file__, 0)
+        runner = doctest.DocTestRunner()
+        runner.run(test)
+        self.assertFalse(runner.failures)
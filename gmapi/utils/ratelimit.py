@@ -0,0 +1,151 @@
+"""Request rate limiting.
+
+A RateLimiter enforces a number of requests per second (as a sliding
+window) and per day. Its counters live in the process and are guarded
+by a lock, or with shared=True in the Django cache, so that every
+worker on every host that uses the same cache stays within one budget.
+The cache needs atomic incr (memcached, Redis or the database cache,
+but not the dummy cache). Days are UTC days.
+
+"""
+import threading
+import time
+from django.core.cache import cache
+
+
+class QuotaExceeded(SystemError):
+    """The daily quota is used up or requests have been paused."""
+
+
+class _LocalStore(object):
+    """The part of the cache API used by RateLimiter, for one process."""
+    def __init__(self, clock=time.time):
+        self._data = {}
+        self._lock = threading.Lock()
+        self._clock = clock
+        self._purged = 0
+
+    def _purge(self):
+        """Drop expired entries, at most once a second.
+
+        Counters for past seconds are never read again, so they
+        wouldn't be dropped by _get.
+
+        """
+        now = self._clock()
+        if now - self._purged >= 1:
+            for key, (value, expires) in self._data.items():
+                if expires is not None and expires <= now:
+                    del self._data[key]
+            self._purged = now
+
+    def _get(self, key):
+        value, expires = self._data.get(key, (None, None))
+        if expires is not None and expires <= self._clock():
+            del self._data[key]
+            return None
+        return value
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._get(key)
+        return default if value is None else value
+
+    def add(self, key, value, timeout):
+        with self._lock:
+            self._purge()
+            if self._get(key) is not None:
+                return False
+            self._data[key] = (value, self._clock() + timeout)
+            return True
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._purge()
+            self._data[key] = (value, self._clock() + timeout)
+
+    def incr(self, key, delta=1):
+        with self._lock:
+            value = self._get(key)
+            if value is None:
+                raise ValueError("Key '%s' not found" % key)
+            self._data[key] = (value + delta, self._data[key][1])
+            return value + delta
+
+    def decr(self, key, delta=1):
+        return self.incr(key, -delta)
+
+
+class RateLimiter(object):
+    """Keeps requests within qps per second and daily per day.
+
+    Either limit may be None for no limit. Limiters with the same
+    prefix share their counters.
+
+    """
+    def __init__(self, qps=None, daily=None, shared=False,
+                 prefix='gmapi.ratelimit', clock=time.time, sleep=time.sleep):
+        self.qps = qps
+        self.daily = daily
+        self.store = cache if shared else _LocalStore(clock)
+        self.prefix = prefix
+        self.clock = clock
+        self.sleep = sleep
+
+    def _key(self, kind, number):
+        return '%s:%s:%d' % (self.prefix, kind, number)
+
+    def _count(self, key, timeout):
+        """Atomically count a request in the counter at key."""
+        self.store.add(key, 0, timeout)
+        try:
+            return self.store.incr(key)
+        except ValueError:
+            # The counter expired in between.
+            self.store.add(key, 1, timeout)
+            return 1
+
+    def acquire(self):
+        """Wait until a request may be made.
+
+        Raises QuotaExceeded right away if the daily quota is used
+        up or requests are paused.
+
+        """
+        while True:
+            now = self.clock()
+            if self.store.get('%s:pause' % self.prefix):
+                raise QuotaExceeded('Requests are paused after the service '
+                                    'reported its limit as exceeded.')
+            day = self._key('day', now // 86400)
+            if self.daily and self.store.get(day, 0) >= self.daily:
+                raise QuotaExceeded('The daily quota of %d requests has '
+                                    'been used up.' % self.daily)
+            if not self.qps:
+                break
+            # Sliding window: weigh the previous second by how much of
+            # it still falls within the last second.
+            second = int(now)
+            key = self._key('sec', second)
+            count = self._count(key, 2)
+            previous = self.store.get(self._key('sec', second - 1), 0)
+            if previous * (1 - (now - second)) + count <= self.qps:
+                break
+            self.store.decr(key)
+            self.sleep(1.0 / self.qps)
+        if self.daily and self._count(day, 2 * 86400) > self.daily:
+            raise QuotaExceeded('The daily quota of %d requests has '
+                                'been used up.' % self.daily)
+
+    def pause(self, seconds):
+        """Fail all requests for a number of seconds."""
+        self.store.set('%s:pause' % self.prefix, True, seconds)
+
+    def remaining(self):
+        """Return the number of requests left today (None if unlimited)."""
+        if self.store.get('%s:pause' % self.prefix):
+            return 0
+        if not self.daily:
+            return None
+        used = self.store.get(self._key('day', self.clock() // 86400), 0)
+        return max(0, self.daily - used)
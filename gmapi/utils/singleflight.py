@@ -0,0 +1,199 @@
+"""Coalescing of concurrent identical calls.
+
+When many requests miss the cache for the same key at once, only one
+of them should do the expensive call while the others wait for its
+result. Group does that for the threads of one process. CachedCall
+adds the cache in front of it and can optionally coordinate processes
+through a short lock in the cache, as well as keep serving a stale
+value while it is refreshed in the background.
+
+"""
+import threading
+import time
+from django.core.cache import cache as default_cache
+
+
+class _Call(object):
+    """A call in flight."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Group(object):
+    """Runs at most one call per key at a time.
+
+    Callers that ask for a key while its call is in flight wait for
+    it and get the same result (or exception).
+
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def running(self, key):
+        """Return whether a call for key is in flight."""
+        return key in self._calls
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        return self.finish(key, call, fn, *args)
+
+    def start(self, key):
+        """Mark a call for key as in flight, unless one already is.
+
+        Returns the call to pass to finish, or None.
+
+        """
+        with self._lock:
+            if key in self._calls:
+                return None
+            call = self._calls[key] = _Call()
+        return call
+
+    def finish(self, key, call, fn, *args):
+        """Make the call marked by start, returning its result."""
+        try:
+            call.result = fn(*args)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+def _spawn(fn, *args):
+    thread = threading.Thread(target=fn, args=args)
+    thread.daemon = True
+    thread.start()
+
+
+class CachedCall(object):
+    """Caches the results of calls, coalescing concurrent misses.
+
+    Values are fresh for timeout seconds and are then served for
+    another stale seconds while they are refreshed in the background.
+    With ahead, values that expire within ahead seconds are refreshed
+    too, so popular ones don't go stale at all. If a refresh fails,
+    the old value is served until it is dropped.
+
+    With lock_timeout, a lock in the cache makes sure only one
+    process makes the call; the others wait up to lock_timeout seconds
+    for its result before making the call themselves.
+
+    """
+    def __init__(self, timeout=300, stale=0, lock_timeout=None, cache=None,
+                 clock=time.time, sleep=time.sleep, ahead=0, spawn=_spawn):
+        self.timeout = timeout
+        self.stale = stale
+        self.lock_timeout = lock_timeout
+        self.cache = cache or default_cache
+        self.clock = clock
+        self.sleep = sleep
+        self.ahead = ahead
+        self.spawn = spawn
+        self.group = Group()
+
+    def _lookup(self, key):
+        """Return the cached (value, fresh) for key, or None.
+
+        Values that expire within ahead seconds don't count as fresh.
+
+        """
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        if not isinstance(entry, tuple):
+            # Stored by an older version, without an expiry time.
+            return entry, True
+        value, expires = entry
+        return value, expires is None or self.clock() < expires - self.ahead
+
+    def set(self, key, value):
+        if self.timeout is None:
+            self.cache.set(key, (value, None), None)
+        else:
+            self.cache.set(key, (value, self.clock() + self.timeout),
+                           self.timeout + self.stale)
+
+    def get(self, key, fn, *args):
+        """Return the value for key, calling fn(*args) if needed."""
+        found = self._lookup(key)
+        if found is None:
+            return self.group.do(key, self._fill, key, fn, args)
+        value, fresh = found
+        if not fresh:
+            # Marked before spawning, so only one thread refreshes it.
+            call = self.group.start(key)
+            if call is None:
+                pass
+            elif self._acquire(key):
+                self.spawn(self._refresh, key, call, fn, args)
+            else:
+                # Another process is refreshing it.
+                self.group.finish(key, call, lambda: value)
+        return value
+
+    def _acquire(self, key):
+        if not self.lock_timeout:
+            return True
+        return self.cache.add('%s:lock' % key, True, self.lock_timeout)
+
+    def _release(self, key):
+        if self.lock_timeout:
+            self.cache.delete('%s:lock' % key)
+
+    def _fill(self, key, fn, args):
+        found = self._lookup(key)
+        if found is not None:
+            # Filled by another thread right before we got here.
+            return found[0]
+        locked = self._acquire(key)
+        if not locked:
+            # Another process is making the call, so wait for it.
+            deadline = self.clock() + self.lock_timeout
+            while self.clock() < deadline:
+                self.sleep(.05)
+                found = self._lookup(key)
+                if found is not None:
+                    return found[0]
+        try:
+            return self._call(key, fn, args)
+        finally:
+            if locked:
+                self._release(key)
+
+    def _refresh(self, key, call, fn, args):
+        """Refresh the value for key, holding the lock taken by get."""
+        try:
+            self.group.finish(key, call, self._update, key, fn, args)
+        except Exception:
+            # Keep serving the old value.
+            pass
+        finally:
+            self._release(key)
+
+    def _update(self, key, fn, args):
+        found = self._lookup(key)
+        if found is not None and found[1]:
+            # Refreshed by another thread or process in the meantime.
+            return found[0]
+        return self._call(key, fn, args)
+
+    def _call(self, key, fn, args):
+        value = fn(*args)
+        self.set(key, value)
+        return value